@@ -0,0 +1,167 @@
+import os
+import re
+import json
+import sqlite3
+from datetime import datetime, timezone
+
+# Emplacement par défaut de la base (modifiable via l'environnement)
+DEFAULT_DB_PATH = os.path.join(os.path.expanduser("~"), ".local", "share", "simba", "analyses.db")
+
+# Instruction ajoutée à l'analyse pour obtenir des scores exploitables en série temporelle
+SCORES_INSTRUCTION = (
+    "Termine ta réponse par une ligne unique au format "
+    "SCORES: {\"joie\": n, \"tristesse\": n, \"colere\": n, \"peur\": n, \"calme\": n, \"energie\": n} "
+    "où chaque n est un entier de 0 à 10 représentant l'intensité actuelle de l'émotion."
+)
+
+_SCORES_PATTERN = re.compile(r"^\s*SCORES\s*:\s*(\{.*\})\s*$", re.MULTILINE)
+
+def extract_scores(text):
+    """
+    Extrait les scores émotionnels de la dernière ligne `SCORES: {...}` d'une analyse.
+
+    Returns:
+        dict: Les scores par émotion (vide si absents ou invalides)
+    """
+    matches = _SCORES_PATTERN.findall(text or "")
+    if not matches:
+        return {}
+    try:
+        scores = json.loads(matches[-1])
+    except ValueError:
+        return {}
+    return {str(k): float(v) for k, v in scores.items() if isinstance(v, (int, float))}
+
+def utc_now():
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+class AnalysisStore:
+    """
+    Historique local des analyses d'état émotionnel.
+
+    Chaque réponse de l'endpoint `analysis` est enregistrée avec ses
+    métadonnées et les scores extraits, indexée par kin et horodatage.
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or os.getenv("SIMBA_ANALYSIS_DB", DEFAULT_DB_PATH)
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(self.db_path)
+        self._db.row_factory = sqlite3.Row
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS analyses (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                blueprint_id TEXT NOT NULL,
+                kin_id TEXT NOT NULL,
+                created_at TEXT NOT NULL,
+                covers_since TEXT,
+                covers_until TEXT NOT NULL,
+                model TEXT,
+                message TEXT,
+                response TEXT,
+                scores TEXT,
+                status TEXT,
+                mode TEXT,
+                raw TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_analyses_kin_time
+                ON analyses (blueprint_id, kin_id, created_at);
+        """)
+
+    def close(self):
+        self._db.close()
+
+    def save(self, blueprint_id, kin_id, result, message=None, model=None,
+             covers_since=None, covers_until=None):
+        """
+        Enregistre une réponse d'analyse.
+
+        Args:
+            blueprint_id (str): L'ID du blueprint
+            kin_id (str): L'ID du Kin
+            result (dict): La réponse de l'API
+            message (str, optional): Le message d'analyse envoyé
+            model (str, optional): Le modèle utilisé
+            covers_since (str, optional): Début de la période analysée (ISO 8601)
+            covers_until (str, optional): Fin de la période analysée. Par défaut maintenant
+
+        Returns:
+            int: L'identifiant de l'analyse enregistrée
+        """
+        now = utc_now()
+        response = result.get("response")
+        cursor = self._db.execute(
+            "INSERT INTO analyses (blueprint_id, kin_id, created_at, covers_since, covers_until, "
+            "model, message, response, scores, status, mode, raw) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                blueprint_id, kin_id, now, covers_since, covers_until or now,
+                model, message, response, json.dumps(extract_scores(response)),
+                result.get("status"), result.get("mode"), json.dumps(result, ensure_ascii=False)
+            )
+        )
+        self._db.commit()
+        return cursor.lastrowid
+
+    def latest(self, blueprint_id, kin_id):
+        """
+        Retourne la dernière analyse enregistrée pour un kin.
+
+        Returns:
+            dict: L'analyse, ou None si aucune n'existe
+        """
+        row = self._db.execute(
+            "SELECT * FROM analyses WHERE blueprint_id = ? AND kin_id = ? "
+            "ORDER BY created_at DESC, id DESC LIMIT 1",
+            (blueprint_id, kin_id)
+        ).fetchone()
+        return self._to_dict(row) if row else None
+
+    def history(self, blueprint_id, kin_id, since=None, until=None, limit=None):
+        """
+        Retourne les analyses d'un kin dans l'ordre chronologique.
+
+        Args:
+            since (str, optional): Horodatage ISO 8601 minimal (inclus)
+            until (str, optional): Horodatage ISO 8601 maximal (inclus)
+            limit (int, optional): Ne garder que les N analyses les plus récentes
+
+        Returns:
+            list: Les analyses sous forme de dictionnaires
+        """
+        query = "SELECT * FROM analyses WHERE blueprint_id = ? AND kin_id = ?"
+        params = [blueprint_id, kin_id]
+        if since:
+            query += " AND created_at >= ?"
+            params.append(since)
+        if until:
+            query += " AND created_at <= ?"
+            params.append(until)
+        query += " ORDER BY created_at DESC, id DESC"
+        if limit:
+            query += " LIMIT ?"
+            params.append(limit)
+        rows = self._db.execute(query, params).fetchall()
+        return [self._to_dict(row) for row in reversed(rows)]
+
+    def trends(self, blueprint_id, kin_id, since=None, until=None, limit=None):
+        """
+        Retourne l'évolution de chaque score émotionnel.
+
+        Returns:
+            dict: Émotion -> liste de couples (horodatage, score)
+        """
+        series = {}
+        for analysis in self.history(blueprint_id, kin_id, since, until, limit):
+            for emotion, score in analysis["scores"].items():
+                series.setdefault(emotion, []).append((analysis["created_at"], score))
+        return series
+
+    @staticmethod
+    def _to_dict(row):
+        analysis = dict(row)
+        analysis["scores"] = json.loads(analysis["scores"] or "{}")
+        analysis["raw"] = json.loads(analysis["raw"] or "{}")
+        return analysis
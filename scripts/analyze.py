@@ -4,11 +4,15 @@ import os
 import argparse
 import base64
 from dotenv import load_dotenv
+import kinos_client
+from usage_accounting import BudgetExceededError
+from settings import get_settings
+from analysis_store import AnalysisStore, SCORES_INSTRUCTION, utc_now
 
 # Charger les variables d'environnement
 load_dotenv()
 
-def analyze_kin(blueprint_id, kin_id, message, images=None, model="claude-3-5-haiku-latest", add_system=None):
+def analyze_kin(blueprint_id, kin_id, message, images=None, model=None, add_system=None):
     """
     Analyse un message avec Claude sans l'enregistrer dans l'historique de conversation.
     
@@ -17,17 +21,17 @@ def analyze_kin(blueprint_id, kin_id, message, images=None, model="claude-3-5-ha
         kin_id (str): L'ID du Kin
         message (str): Le message à analyser
         images (list, optional): Liste des chemins d'images à envoyer
-        model (str, optional): Le modèle à utiliser. Par défaut "claude-3-5-haiku-latest"
+        model (str, optional): Le modèle à utiliser. Par défaut le réglage model
         add_system (str, optional): Instructions système supplémentaires
     
     Returns:
         dict: La réponse de l'API
     """
     # URL de l'API
-    api_url = f"https://api.kinos-engine.ai/v2/blueprints/{blueprint_id}/kins/{kin_id}/analysis"
+    api_url = f"{kinos_client.KINOS_API_BASE}/blueprints/{blueprint_id}/kins/{kin_id}/analysis"
     
-    # Récupérer la clé API depuis les variables d'environnement
-    api_key = os.getenv("KINOS_API_KEY")
+    # Récupérer la clé API depuis la configuration
+    api_key = get_settings().kinos_api_key
     
     if not api_key:
         raise ValueError("La clé API KINOS_API_KEY n'est pas définie dans les variables d'environnement")
@@ -41,7 +45,7 @@ def analyze_kin(blueprint_id, kin_id, message, images=None, model="claude-3-5-ha
     # Préparer le corps de la requête
     payload = {
         "message": message,
-        "model": model
+        "model": model or get_settings().model
     }
     
     # Ajouter les instructions système si spécifiées
@@ -76,7 +80,7 @@ def analyze_kin(blueprint_id, kin_id, message, images=None, model="claude-3-5-ha
         print(f"Envoi de la requête d'analyse à {api_url}")
         print(f"Payload: {json.dumps(payload, indent=2)}")
         
-        response = requests.post(api_url, headers=headers, json=payload)
+        response = kinos_client.post(api_url, headers, payload)
         
         print(f"Code de statut HTTP: {response.status_code}")
         print(f"Réponse brute: {response.text}")
@@ -87,35 +91,105 @@ def analyze_kin(blueprint_id, kin_id, message, images=None, model="claude-3-5-ha
         result = response.json()
         return result
     
+    except BudgetExceededError as e:
+        print(f"Requête refusée: {e}")
+        return None
+    
     except requests.exceptions.RequestException as e:
         print(f"Erreur lors de l'analyse: {e}")
         if hasattr(e, 'response') and e.response:
             print(f"Détails de l'erreur: {e.response.text}")
         return None
 
+def incremental_instructions(previous):
+    """
+    Construit les instructions d'une analyse incrémentale.
+    
+    La précédente analyse est fournie au modèle, qui ne met à jour l'état
+    émotionnel qu'à partir des échanges postérieurs à celle-ci : la période
+    déjà analysée n'est pas réanalysée.
+    
+    Args:
+        previous (dict): La dernière analyse enregistrée
+    
+    Returns:
+        str: Les instructions système à ajouter
+    """
+    return (
+        f"Une analyse précédente a été réalisée le {previous['covers_until']} (UTC). "
+        f"La voici :\n<analyse_precedente>\n{previous['response']}\n</analyse_precedente>\n"
+        "Ne réanalyse pas la période déjà couverte : base-toi uniquement sur les conversations "
+        "et souvenirs postérieurs à cette date pour décrire ce qui a changé, puis donne l'état "
+        "émotionnel mis à jour."
+    )
+
+def print_trends(store, blueprint_id, kin_id, limit=None):
+    """Affiche l'évolution des scores émotionnels enregistrés."""
+    history = store.history(blueprint_id, kin_id, limit=limit)
+    if not history:
+        print("Aucune analyse enregistrée")
+        return
+    
+    emotions = sorted({emotion for analysis in history for emotion in analysis["scores"]})
+    print(f"{'Date (UTC)':<26}" + "".join(f"{emotion:>11}" for emotion in emotions))
+    for analysis in history:
+        scores = analysis["scores"]
+        print(f"{analysis['created_at']:<26}" + "".join(
+            f"{scores[emotion]:>11.1f}" if emotion in scores else f"{'-':>11}" for emotion in emotions
+        ))
+
 if __name__ == "__main__":
     # Configurer les arguments de ligne de commande
     parser = argparse.ArgumentParser(description="Analyser l'état émotionnel de Simba")
     parser.add_argument("--message", default="Analyse l'état émotionnel actuel de Simba. Comment se sent-il? Quelles sont ses préoccupations actuelles? Quels sont ses désirs et ses besoins?", 
                         help="Le message d'analyse à envoyer")
     parser.add_argument("--images", nargs="+", help="Chemins des images à envoyer")
-    parser.add_argument("--model", default="claude-3-5-haiku-latest", help="Modèle à utiliser")
+    parser.add_argument("--model", help="Modèle à utiliser (par défaut le réglage model)")
     parser.add_argument("--add-system", default="Analyse en profondeur l'état émotionnel actuel de Simba en te basant sur ses conversations récentes, ses souvenirs et sa personnalité. Identifie ses émotions dominantes, ses préoccupations, ses désirs et ses besoins. Fournis une analyse psychologique détaillée mais accessible.", 
                         help="Instructions système supplémentaires")
+    parser.add_argument("--incremental", action="store_true",
+                        help="N'analyser que les échanges depuis la dernière analyse enregistrée")
+    parser.add_argument("--no-store", action="store_true", help="Ne pas enregistrer l'analyse")
+    parser.add_argument("--trends", nargs="?", type=int, const=0, metavar="N",
+                        help="Afficher l'évolution des N dernières analyses enregistrées (toutes par défaut) sans appeler l'API")
+    parser.add_argument("--db", help="Chemin de la base des analyses")
     args = parser.parse_args()
     
     # Paramètres pour Simba
-    blueprint_id = "simba"
-    kin_id = "simba"
+    settings = get_settings()
+    blueprint_id = settings.blueprint_id
+    kin_id = settings.kin_id
+    
+    # La base sert à enregistrer l'analyse, mais aussi à l'analyse incrémentale et aux tendances
+    needs_store = not args.no_store or args.incremental or args.trends is not None
+    store = AnalysisStore(args.db) if needs_store else None
+    
+    if args.trends is not None:
+        print_trends(store, blueprint_id, kin_id, limit=args.trends or None)
+        raise SystemExit(0)
+    
+    add_system = args.add_system
+    covers_since = None
+    if args.incremental:
+        previous = store.latest(blueprint_id, kin_id)
+        if previous:
+            covers_since = previous["covers_until"]
+            add_system = f"{add_system}\n\n{incremental_instructions(previous)}"
+            print(f"Analyse incrémentale depuis le {covers_since}")
+        else:
+            print("Aucune analyse précédente : analyse complète")
+    if not args.no_store:
+        add_system = f"{add_system}\n\n{SCORES_INSTRUCTION}"
     
     # Analyser l'état émotionnel de Simba
+    started_at = utc_now()
     result = analyze_kin(
         blueprint_id=blueprint_id,
         kin_id=kin_id,
         message=args.message,
         images=args.images,
         model=args.model,
-        add_system=args.add_system
+        add_system=add_system
     )
     
     # Afficher le résultat
@@ -134,5 +208,16 @@ if __name__ == "__main__":
         print("=" * 60)
         print(f"Statut: {result.get('status')}")
         print(f"Mode: {result.get('mode')}")
+        
+        # Enregistrer l'analyse pour le suivi dans le temps
+        if not args.no_store:
+            analysis_id = store.save(
+                blueprint_id, kin_id, result,
+                message=args.message,
+                model=args.model or settings.model,
+                covers_since=covers_since,
+                covers_until=started_at
+            )
+            print(f"Analyse enregistrée (#{analysis_id}) dans {store.db_path}")
     else:
         print("Échec de l'analyse")
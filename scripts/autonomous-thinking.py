@@ -1,9 +1,9 @@
 import requests
 import json
-import os
-import asyncio
-import telegram
 from dotenv import load_dotenv
+import kinos_client
+from usage_accounting import BudgetExceededError
+from settings import get_settings
 import argparse
 
 # Charger les variables d'environnement
@@ -23,10 +23,10 @@ def trigger_autonomous_thinking(blueprint_id, kin_id, iterations=3, wait_time=60
         dict: La réponse de l'API
     """
     # URL de l'API
-    api_url = f"https://api.kinos-engine.ai/v2/blueprints/{blueprint_id}/kins/{kin_id}/autonomous_thinking"
+    api_url = f"{kinos_client.KINOS_API_BASE}/blueprints/{blueprint_id}/kins/{kin_id}/autonomous_thinking"
     
-    # Récupérer la clé API depuis les variables d'environnement
-    api_key = os.getenv("KINOS_API_KEY")
+    # Récupérer la clé API depuis la configuration
+    api_key = get_settings().kinos_api_key
     
     if not api_key:
         raise ValueError("La clé API KINOS_API_KEY n'est pas définie dans les variables d'environnement")
@@ -45,13 +45,17 @@ def trigger_autonomous_thinking(blueprint_id, kin_id, iterations=3, wait_time=60
     
     # Effectuer la requête POST
     try:
-        response = requests.post(api_url, headers=headers, json=payload)
+        response = kinos_client.post(api_url, headers, payload)
         response.raise_for_status()  # Lever une exception si la requête a échoué
         
         # Analyser la réponse JSON
         result = response.json()
         return result
     
+    except BudgetExceededError as e:
+        print(f"Requête refusée: {e}")
+        return None
+    
     except requests.exceptions.RequestException as e:
         print(f"Erreur lors de la requête API: {e}")
         if hasattr(e, 'response') and e.response:
@@ -62,9 +66,10 @@ def send_initiative_message():
     """
     Envoie un message d'initiative à KinOS pour composer un message pour maman.
     """
-    api_url = f"https://api.kinos-engine.ai/v2/blueprints/simba/kins/simba/messages"
+    settings = get_settings()
+    api_url = f"{kinos_client.KINOS_API_BASE}/blueprints/{settings.blueprint_id}/kins/{settings.kin_id}/messages"
     
-    api_key = os.getenv("KINOS_API_KEY")
+    api_key = settings.kinos_api_key
     
     headers = {
         "Authorization": f"Bearer {api_key}",
@@ -73,11 +78,11 @@ def send_initiative_message():
     
     payload = {
         "content": "<system>Compose un message pour maman</system>",
-        "model": "claude-3-5-haiku-latest"
+        "model": settings.model
     }
 
     try:
-        response = requests.post(api_url, headers=headers, json=payload)
+        response = kinos_client.post(api_url, headers, payload)
         response.raise_for_status()
         result = response.json()
         return result.get("response") or result.get("content")
@@ -94,9 +99,13 @@ async def send_telegram_notification(message, chat_id, token):
         chat_id (str): L'ID du chat Telegram
         token (str): Le token du bot Telegram
     """
+    # Import différé : le module telegram est lourd et n'est utile qu'à l'envoi
+    import telegram
+    from reply_format import send_text
+    
     try:
         bot = telegram.Bot(token=token)
-        await bot.send_message(chat_id=chat_id, text=message, parse_mode='Markdown')
+        await send_text(bot, chat_id, message)
         print("Notification Telegram envoyée avec succès")
     except Exception as e:
         print(f"Erreur lors de l'envoi de la notification Telegram: {e}")
@@ -109,8 +118,9 @@ if __name__ == "__main__":
     args = parser.parse_args()
     
     # Paramètres pour Simba
-    blueprint_id = "simba"
-    kin_id = "simba"
+    settings = get_settings()
+    blueprint_id = settings.blueprint_id
+    kin_id = settings.kin_id
     
     # Déclencher la pensée autonome
     result = trigger_autonomous_thinking(
@@ -132,10 +142,12 @@ if __name__ == "__main__":
         
         if message:
             # Envoyer via Telegram
-            telegram_token = os.getenv("TELEGRAM_BOT_TOKEN")
-            telegram_chat_id = os.getenv("TELEGRAM_CHAT_ID")
+            telegram_token = settings.telegram_bot_token
+            # Les notifications partent vers le premier chat autorisé
+            telegram_chat_id = next((c for c in settings.telegram_chat_id or [] if c != "*"), None)
             
             if telegram_token and telegram_chat_id:
+                import asyncio
                 asyncio.run(send_telegram_notification(message, telegram_chat_id, telegram_token))
             else:
                 print("Variables d'environnement Telegram non définies")
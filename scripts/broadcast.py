@@ -0,0 +1,224 @@
+import json
+import time
+import asyncio
+import argparse
+import contextlib
+from dotenv import load_dotenv
+import kinos_client
+from settings import get_settings
+from reply_format import format_reply, send_text
+
+# Charger les variables d'environnement
+load_dotenv()
+
+DEFAULT_PROMPT = "<system>Compose un message pour maman</system>"
+
+def compose_initiative_message(blueprint_id, kin_id, prompt=DEFAULT_PROMPT, model=None):
+    """
+    Demande à un Kin de composer un message d'initiative.
+
+    Args:
+        blueprint_id (str): L'ID du blueprint
+        kin_id (str): L'ID du Kin
+        prompt (str, optional): La consigne envoyée au Kin
+        model (str, optional): Le modèle à utiliser. Par défaut le réglage model
+
+    Returns:
+        str: Le message composé
+    """
+    api_url = f"{kinos_client.KINOS_API_BASE}/blueprints/{blueprint_id}/kins/{kin_id}/messages"
+
+    api_key = get_settings().kinos_api_key
+
+    if not api_key:
+        raise ValueError("La clé API KINOS_API_KEY n'est pas définie dans les variables d'environnement")
+
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json"
+    }
+
+    payload = {
+        "content": prompt,
+        "model": model or get_settings().model
+    }
+
+    response = kinos_client.post(api_url, headers, payload)
+    response.raise_for_status()
+    result = response.json()
+    return result.get("response") or result.get("content")
+
+class ChatRateLimiter:
+    """
+    Limite le débit d'envoi par chat.
+
+    Telegram refuse plus d'environ un message par seconde dans un même chat :
+    les envois vers un chat donné sont espacés d'au moins `interval` secondes,
+    comptées à partir de la fin de l'envoi précédent, tandis que des chats
+    différents sont servis en parallèle.
+    """
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self._locks = {}
+        self._last_sent = {}
+
+    @contextlib.asynccontextmanager
+    async def sending(self, chat_id):
+        """Attend le tour du chat, puis date l'envoi effectué dans le bloc."""
+        lock = self._locks.setdefault(chat_id, asyncio.Lock())
+        async with lock:
+            delay = self._last_sent.get(chat_id, 0) + self.interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                yield
+            finally:
+                self._last_sent[chat_id] = time.monotonic()
+
+async def broadcast(blueprint_id, kin_ids, chat_ids, token, prompt=DEFAULT_PROMPT,
+                    model=None, concurrency=None, chat_interval=None):
+    """
+    Compose un message d'initiative par Kin et le distribue à tous les chats.
+
+    Les appels à KinOS et les envois Telegram partagent une limite de
+    concurrence commune ; chaque chat est en outre soumis à son propre débit.
+
+    Args:
+        blueprint_id (str): L'ID du blueprint
+        kin_ids (list): Les IDs des Kins qui composent un message
+        chat_ids (list): Les IDs des chats Telegram destinataires
+        token (str): Le token du bot Telegram (None pour ne rien envoyer)
+        prompt (str, optional): La consigne envoyée à chaque Kin
+        model (str, optional): Le modèle à utiliser
+        concurrency (int, optional): Nombre maximal d'opérations simultanées. Par défaut le réglage broadcast_concurrency
+        chat_interval (float, optional): Délai minimal entre deux envois à un même chat, en secondes. Par défaut le réglage broadcast_chat_interval
+
+    Returns:
+        list: Le rapport de distribution, une entrée par couple (kin, chat)
+    """
+    settings = get_settings()
+    semaphore = asyncio.Semaphore(concurrency or settings.broadcast_concurrency)
+    limiter = ChatRateLimiter(settings.broadcast_chat_interval if chat_interval is None else chat_interval)
+    report = []
+
+    async def compose(kin_id):
+        async with semaphore:
+            start = time.monotonic()
+            try:
+                message = await asyncio.to_thread(
+                    compose_initiative_message, blueprint_id, kin_id, prompt, model
+                )
+                error = None if message else "Réponse vide"
+            except Exception as e:
+                message, error = None, str(e)
+            return message, error, time.monotonic() - start
+
+    async def deliver(bot, chat_id, parts):
+        async with semaphore:
+            start = time.monotonic()
+            try:
+                # Chaque morceau d'un long message est un envoi Telegram : il est espacé lui aussi
+                for part in parts:
+                    async with limiter.sending(chat_id):
+                        await send_text(bot, chat_id, parts=[part])
+                error = None
+            except Exception as e:
+                error = str(e)
+            return error, time.monotonic() - start
+
+    async def run(bot, kin_id):
+        message, error, compose_time = await compose(kin_id)
+        entries = []
+        if error:
+            for chat_id in chat_ids:
+                entries.append({"kin": kin_id, "chat": chat_id, "status": "échec composition",
+                                "error": error, "compose_s": round(compose_time, 3), "send_s": None})
+            return entries
+
+        # Mise en forme et découpage calculés une seule fois pour tous les chats
+        parts = format_reply(message)
+
+        async def deliver_one(chat_id):
+            if bot is None:
+                return {"kin": kin_id, "chat": chat_id, "status": "non envoyé", "error": None,
+                        "compose_s": round(compose_time, 3), "send_s": None, "message": message}
+            send_error, send_time = await deliver(bot, chat_id, parts)
+            return {"kin": kin_id, "chat": chat_id,
+                    "status": "échec envoi" if send_error else "envoyé", "error": send_error,
+                    "compose_s": round(compose_time, 3), "send_s": round(send_time, 3)}
+
+        return await asyncio.gather(*(deliver_one(chat_id) for chat_id in chat_ids))
+
+    if token:
+        # Import différé : inutile quand les messages sont seulement composés
+        import telegram
+        async with telegram.Bot(token=token) as bot:
+            results = await asyncio.gather(*(run(bot, kin_id) for kin_id in kin_ids))
+    else:
+        results = await asyncio.gather(*(run(None, kin_id) for kin_id in kin_ids))
+
+    for entries in results:
+        report.extend(entries)
+    return report
+
+def print_report(report):
+    """Affiche le rapport de distribution."""
+    print(f"{'Kin':<15}{'Chat':<18}{'Statut':<20}{'Composition':>12}{'Envoi':>9}")
+    for entry in report:
+        compose_s = f"{entry['compose_s']:.2f}s" if entry["compose_s"] is not None else "-"
+        send_s = f"{entry['send_s']:.2f}s" if entry["send_s"] is not None else "-"
+        print(f"{entry['kin']:<15}{str(entry['chat']):<18}{entry['status']:<20}{compose_s:>12}{send_s:>9}")
+        if entry["error"]:
+            print(f"    Erreur: {entry['error']}")
+        elif entry.get("message"):
+            print(f"    Message: {entry['message']}")
+
+    delivered = sum(1 for entry in report if entry["status"] == "envoyé")
+    print(f"\n{delivered}/{len(report)} messages envoyés")
+
+if __name__ == "__main__":
+    # Configurer les arguments de ligne de commande
+    parser = argparse.ArgumentParser(description="Envoyer des messages d'initiative à plusieurs chats et Kins")
+    parser.add_argument("--kins", nargs="+", help="IDs des Kins qui composent un message (par défaut le réglage kin_id)")
+    parser.add_argument("--chats", nargs="+",
+                        help="IDs des chats Telegram destinataires (par défaut TELEGRAM_CHAT_ID, séparés par des virgules)")
+    parser.add_argument("--prompt", default=DEFAULT_PROMPT, help="Consigne envoyée à chaque Kin")
+    parser.add_argument("--model", help="Modèle à utiliser (par défaut le réglage model)")
+    parser.add_argument("--concurrency", type=int,
+                        help="Nombre maximal d'opérations simultanées (par défaut le réglage broadcast_concurrency)")
+    parser.add_argument("--chat-interval", type=float,
+                        help="Délai minimal entre deux messages à un même chat, en secondes (par défaut le réglage broadcast_chat_interval)")
+    parser.add_argument("--report", help="Fichier JSON où écrire le rapport de distribution")
+    parser.add_argument("--no-telegram", action="store_true", help="Composer les messages sans les envoyer")
+    args = parser.parse_args()
+
+    # Paramètres pour Simba
+    settings = get_settings()
+    blueprint_id = settings.blueprint_id
+
+    chat_ids = args.chats or [c for c in settings.telegram_chat_id or [] if c != "*"]
+    telegram_token = None if args.no_telegram else settings.telegram_bot_token
+    if args.no_telegram and not chat_ids:
+        chat_ids = ["-"]
+
+    if not chat_ids or (not args.no_telegram and not telegram_token):
+        print("Variables d'environnement TELEGRAM_BOT_TOKEN et/ou TELEGRAM_CHAT_ID non définies")
+    else:
+        report = asyncio.run(broadcast(
+            blueprint_id=blueprint_id,
+            kin_ids=args.kins or [settings.kin_id],
+            chat_ids=chat_ids,
+            token=telegram_token,
+            prompt=args.prompt,
+            model=args.model,
+            concurrency=args.concurrency,
+            chat_interval=args.chat_interval
+        ))
+
+        print_report(report)
+
+        if args.report:
+            with open(args.report, "w", encoding="utf-8") as report_file:
+                json.dump(report, report_file, ensure_ascii=False, indent=2)
+            print(f"Rapport écrit dans {args.report}")
@@ -0,0 +1,78 @@
+import asyncio
+import logging
+from settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+class ChatActionKeeper:
+    """
+    Maintient une action de chat (« en train d'écrire », « envoie une photo »...)
+    pendant toute la durée d'un traitement.
+
+    S'utilise comme gestionnaire de contexte asynchrone : l'action est
+    envoyée à l'entrée, renouvelée en arrière-plan toutes les `interval`
+    secondes (réglage chat_action_interval : Telegram efface l'indicateur au
+    bout d'environ 5 s), et la tâche est annulée à la sortie, que le traitement ait
+    réussi ou non. Sans cela, l'indicateur disparaît pendant les réponses
+    lentes et l'utilisateur renvoie son message. Si `progress_text` est
+    fourni, il est envoyé une fois après `progress_after` secondes (réglage
+    progress_after, 0 = jamais).
+
+    Exemple :
+        async with ChatActionKeeper(context.bot, chat_id, "typing"):
+            response = await send_to_kinos(...)
+    """
+
+    def __init__(self, bot, chat_id, action="typing", interval=None,
+                 progress_text=None, progress_after=None, reply_to_message_id=None):
+        settings = get_settings()
+        self.bot = bot
+        self.chat_id = chat_id
+        self.action = action
+        self.interval = interval if interval is not None else settings.chat_action_interval
+        self.progress_text = progress_text
+        self.progress_after = progress_after if progress_after is not None else settings.progress_after
+        self.reply_to_message_id = reply_to_message_id
+        self._task = None
+
+    async def _send(self):
+        try:
+            await self.bot.send_chat_action(chat_id=self.chat_id, action=self.action)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Un indicateur manqué ne doit jamais interrompre le traitement
+            logger.warning(f"Impossible d'envoyer l'action {self.action} au chat {self.chat_id}: {e}")
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        progress_at = None
+        if self.progress_text and self.progress_after > 0:
+            progress_at = loop.time() + self.progress_after
+        while True:
+            await asyncio.sleep(self.interval)
+            if progress_at is not None and loop.time() >= progress_at:
+                progress_at = None
+                try:
+                    await self.bot.send_message(
+                        chat_id=self.chat_id, text=self.progress_text,
+                        reply_to_message_id=self.reply_to_message_id
+                    )
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.warning(f"Impossible d'envoyer le message d'attente au chat {self.chat_id}: {e}")
+            await self._send()
+
+    async def __aenter__(self):
+        await self._send()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        return False
@@ -1,7 +1,10 @@
+import argparse
 import requests
 import json
-import os
 from dotenv import load_dotenv
+import kinos_client
+from usage_accounting import BudgetExceededError
+from settings import get_settings
 
 # Charger les variables d'environnement
 load_dotenv()
@@ -19,10 +22,10 @@ def create_kin(blueprint_id, kin_name, template_override=None):
         dict: La réponse de l'API contenant les informations du kin créé
     """
     # URL de l'API
-    api_url = f"https://api.kinos-engine.ai/v2/blueprints/{blueprint_id}/kins"
+    api_url = f"{kinos_client.KINOS_API_BASE}/blueprints/{blueprint_id}/kins"
     
-    # Récupérer la clé API depuis les variables d'environnement
-    api_key = os.getenv("KINOS_API_KEY")
+    # Récupérer la clé API depuis la configuration
+    api_key = get_settings().kinos_api_key
     
     if not api_key:
         raise ValueError("La clé API KINOS_API_KEY n'est pas définie dans les variables d'environnement")
@@ -44,13 +47,17 @@ def create_kin(blueprint_id, kin_name, template_override=None):
     
     # Effectuer la requête POST
     try:
-        response = requests.post(api_url, headers=headers, json=payload)
+        response = kinos_client.post(api_url, headers, payload)
         response.raise_for_status()  # Lever une exception si la requête a échoué
         
         # Analyser la réponse JSON
         result = response.json()
         return result
     
+    except BudgetExceededError as e:
+        print(f"Requête refusée: {e}")
+        return None
+    
     except requests.exceptions.RequestException as e:
         print(f"Erreur lors de la création du kin: {e}")
         if hasattr(e, 'response') and e.response:
@@ -58,9 +65,14 @@ def create_kin(blueprint_id, kin_name, template_override=None):
         return None
 
 if __name__ == "__main__":
+    # Configurer les arguments de ligne de commande
+    parser = argparse.ArgumentParser(description="Créer le Kin Simba (réglages blueprint_id et kin_id)")
+    parser.parse_args()
+    
     # Paramètres pour Simba
-    blueprint_id = "simba"
-    kin_name = "simba"
+    settings = get_settings()
+    blueprint_id = settings.blueprint_id
+    kin_name = settings.kin_id
     
     # Créer le kin Simba
     result = create_kin(blueprint_id, kin_name)
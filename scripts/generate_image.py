@@ -1,16 +1,16 @@
 import requests
 import json
-import os
 import argparse
-import time
-import telegram
-import asyncio
 from dotenv import load_dotenv
+import kinos_client
+from usage_accounting import BudgetExceededError
+from settings import get_settings
+from media_cache import get_cache
 
 # Charger les variables d'environnement
 load_dotenv()
 
-def generate_image(blueprint_id, kin_id, message, aspect_ratio="ASPECT_1_1", model="V_2A", magic_prompt_option="AUTO"):
+def generate_image(blueprint_id, kin_id, message, aspect_ratio="ASPECT_1_1", model=None, magic_prompt_option="AUTO"):
     """
     Génère une image basée sur un message en utilisant l'API Ideogram via KinOS.
     
@@ -19,17 +19,17 @@ def generate_image(blueprint_id, kin_id, message, aspect_ratio="ASPECT_1_1", mod
         kin_id (str): L'ID du Kin
         message (str): Le message pour générer l'image
         aspect_ratio (str, optional): Ratio d'aspect de l'image. Par défaut "ASPECT_1_1"
-        model (str, optional): Modèle à utiliser. Par défaut "V_2"
+        model (str, optional): Modèle à utiliser. Par défaut le réglage image_model
         magic_prompt_option (str, optional): Option de prompt magique. Par défaut "AUTO"
     
     Returns:
         dict: La réponse de l'API
     """
     # URL de l'API
-    api_url = f"https://api.kinos-engine.ai/v2/blueprints/{blueprint_id}/kins/{kin_id}/images"
+    api_url = f"{kinos_client.KINOS_API_BASE}/blueprints/{blueprint_id}/kins/{kin_id}/images"
     
-    # Récupérer la clé API depuis les variables d'environnement
-    api_key = os.getenv("KINOS_API_KEY")
+    # Récupérer la clé API depuis la configuration
+    api_key = get_settings().kinos_api_key
     
     if not api_key:
         raise ValueError("La clé API KINOS_API_KEY n'est pas définie dans les variables d'environnement")
@@ -40,16 +40,14 @@ def generate_image(blueprint_id, kin_id, message, aspect_ratio="ASPECT_1_1", mod
         "Content-Type": "application/json"
     }
     
-    # Ajouter des mots-clés pour obtenir un style de dessin d'enfant
-    child_drawing_keywords = ", 4 year old child drawing, crayon drawing, colorful scribbles, simple shapes, childish art style, cute doodles, messy coloring, kindergarten art, construction paper, finger painting, naive art"
-    
-    # Préparer le corps de la requête avec le message enrichi
-    enhanced_message = f"{message}{child_drawing_keywords}"
+    # Ajouter des mots-clés pour obtenir un style de dessin d'enfant (réglage image_style_suffix)
+    settings = get_settings()
+    enhanced_message = f"{message}{settings.image_style_suffix}"
     
     payload = {
         "message": enhanced_message,
         "aspect_ratio": aspect_ratio,
-        "model": model,
+        "model": model or settings.image_model,
         "magic_prompt_option": magic_prompt_option
     }
     
@@ -60,7 +58,7 @@ def generate_image(blueprint_id, kin_id, message, aspect_ratio="ASPECT_1_1", mod
         print(f"Message enrichi: {enhanced_message}")
         print(f"Payload: {json.dumps(payload, indent=2)}")
         
-        response = requests.post(api_url, headers=headers, json=payload)
+        response = kinos_client.post(api_url, headers, payload)
         
         print(f"Code de statut HTTP: {response.status_code}")
         print(f"Réponse brute: {response.text}")
@@ -71,13 +69,67 @@ def generate_image(blueprint_id, kin_id, message, aspect_ratio="ASPECT_1_1", mod
         result = response.json()
         return result
     
+    except BudgetExceededError as e:
+        print(f"Requête refusée: {e}")
+        return None
+    
     except requests.exceptions.RequestException as e:
         print(f"Erreur lors de la génération de l'image: {e}")
         if hasattr(e, 'response') and e.response:
             print(f"Détails de l'erreur: {e.response.text}")
         return None
 
-def send_message_with_image(blueprint_id, kin_id, content, image_url, model="claude-3-5-haiku-latest"):
+def get_image_data_url(image_url):
+    """
+    Retourne l'image sous forme d'URL data en base64, en passant par le cache local.
+    
+    L'image brute et sa version encodée sont conservées dans le cache média :
+    une image déjà vue n'est ni retéléchargée ni réencodée.
+    
+    Args:
+        image_url (str): L'URL de l'image
+    
+    Returns:
+        str: L'URL data de l'image
+    """
+    cache = get_cache()
+    cached = cache.get_variant(image_url, "data_url")
+    if cached:
+        print("Image trouvée dans le cache local")
+        return cached.decode("utf-8")
+    
+    image_bytes = cache.get(image_url)
+    if image_bytes is None:
+        image_response = requests.get(image_url)
+        image_response.raise_for_status()
+        image_bytes = image_response.content
+        cache.put(image_bytes, aliases=[image_url])
+    
+    # Encoder l'image en base64
+    import base64
+    image_data = base64.b64encode(image_bytes).decode('utf-8')
+    
+    # Déterminer le type MIME en fonction de l'URL ou du contenu
+    mime_type = "image/jpeg"  # Par défaut
+    
+    # Vérifier si l'URL contient une extension
+    if ".png" in image_url.lower():
+        mime_type = "image/png"
+    elif ".jpg" in image_url.lower() or ".jpeg" in image_url.lower():
+        mime_type = "image/jpeg"
+    elif ".gif" in image_url.lower():
+        mime_type = "image/gif"
+    elif ".webp" in image_url.lower():
+        mime_type = "image/webp"
+    
+    print(f"Type MIME détecté: {mime_type}")
+    
+    # Créer l'URL data avec le bon type MIME
+    image_data_url = f"data:{mime_type};base64,{image_data}"
+    cache.put_variant(image_url, "data_url", image_data_url)
+    return image_data_url
+
+def send_message_with_image(blueprint_id, kin_id, content, image_url, model=None):
     """
     Envoie un message avec une image à un Kin.
     
@@ -86,16 +138,16 @@ def send_message_with_image(blueprint_id, kin_id, content, image_url, model="cla
         kin_id (str): L'ID du Kin
         content (str): Le contenu du message
         image_url (str): L'URL de l'image à envoyer
-        model (str, optional): Le modèle à utiliser. Par défaut "claude-3-5-haiku-latest"
+        model (str, optional): Le modèle à utiliser. Par défaut le réglage model
     
     Returns:
         dict: La réponse de l'API
     """
     # URL de l'API
-    api_url = f"https://api.kinos-engine.ai/v2/blueprints/{blueprint_id}/kins/{kin_id}/messages"
+    api_url = f"{kinos_client.KINOS_API_BASE}/blueprints/{blueprint_id}/kins/{kin_id}/messages"
     
-    # Récupérer la clé API depuis les variables d'environnement
-    api_key = os.getenv("KINOS_API_KEY")
+    # Récupérer la clé API depuis la configuration
+    api_key = get_settings().kinos_api_key
     
     # Préparer les headers avec l'authentification
     headers = {
@@ -103,42 +155,19 @@ def send_message_with_image(blueprint_id, kin_id, content, image_url, model="cla
         "Content-Type": "application/json"
     }
     
-    # Télécharger l'image depuis l'URL
+    # Télécharger l'image depuis l'URL (ou la relire depuis le cache local)
     try:
-        image_response = requests.get(image_url)
-        image_response.raise_for_status()
-        
-        # Encoder l'image en base64
-        import base64
-        image_data = base64.b64encode(image_response.content).decode('utf-8')
-        
-        # Déterminer le type MIME en fonction de l'URL ou du contenu
-        mime_type = "image/jpeg"  # Par défaut
-        
-        # Vérifier si l'URL contient une extension
-        if ".png" in image_url.lower():
-            mime_type = "image/png"
-        elif ".jpg" in image_url.lower() or ".jpeg" in image_url.lower():
-            mime_type = "image/jpeg"
-        elif ".gif" in image_url.lower():
-            mime_type = "image/gif"
-        elif ".webp" in image_url.lower():
-            mime_type = "image/webp"
-        
-        # Créer l'URL data avec le bon type MIME
-        image_data_url = f"data:{mime_type};base64,{image_data}"
-        
-        print(f"Type MIME détecté: {mime_type}")
+        image_data_url = get_image_data_url(image_url)
         
         # Préparer le corps de la requête
         payload = {
             "content": content,
-            "model": model,
+            "model": model or get_settings().model,
             "images": [image_data_url]
         }
         
         # Effectuer la requête POST
-        response = requests.post(api_url, headers=headers, json=payload)
+        response = kinos_client.post(api_url, headers, payload)
         response.raise_for_status()
         
         # Analyser la réponse JSON
@@ -149,7 +178,35 @@ def send_message_with_image(blueprint_id, kin_id, content, image_url, model="cla
         print(f"Erreur lors de l'envoi du message avec image: {e}")
         return None
 
-async def send_telegram_notification(message, image_url, chat_id, token):
+async def draw_with_indicator(token, chat_id, draw, message):
+    """
+    Dessine puis envoie l'image en maintenant l'action « envoie une photo » dans le chat Telegram.
+    
+    L'action reste affichée de la génération jusqu'à l'envoi de la photo,
+    y compris pendant l'envoi de l'image au Kin.
+    
+    Args:
+        token (str): Le token du bot Telegram
+        chat_id (str): L'ID du chat Telegram
+        draw (callable): Fonction bloquante qui génère l'image et retourne son URL (ou None)
+        message (str): La légende de la photo
+    
+    Returns:
+        str: L'URL de l'image, ou None en cas d'échec
+    """
+    # Imports différés : le module telegram est lourd et inutile avec --no-telegram
+    import asyncio
+    import telegram
+    from chat_action import ChatActionKeeper
+    
+    async with telegram.Bot(token=token) as bot:
+        async with ChatActionKeeper(bot, chat_id, "upload_photo"):
+            image_url = await asyncio.to_thread(draw)
+            if image_url:
+                await send_telegram_notification(message, image_url, chat_id, token, bot=bot)
+    return image_url
+
+async def send_telegram_notification(message, image_url, chat_id, token, bot=None):
     """
     Envoie une notification Telegram avec une image.
     
@@ -158,12 +215,22 @@ async def send_telegram_notification(message, image_url, chat_id, token):
         image_url (str): L'URL de l'image à envoyer
         chat_id (str): L'ID du chat Telegram
         token (str): Le token du bot Telegram
+        bot (telegram.Bot, optional): Un bot déjà ouvert, à réutiliser
     """
+    # Import différé : le module telegram est lourd et inutile avec --no-telegram
+    import telegram
+    from reply_format import MAX_CAPTION_LENGTH, send_text, telegram_length
+    
     try:
-        bot = telegram.Bot(token=token)
+        bot = bot or telegram.Bot(token=token)
         
-        # Envoyer l'image avec la légende
-        await bot.send_photo(chat_id=chat_id, photo=image_url, caption=message)
+        # Envoyer l'image avec la légende ; une légende trop longue serait refusée,
+        # le message part alors à la suite de l'image
+        if telegram_length(message) <= MAX_CAPTION_LENGTH:
+            await bot.send_photo(chat_id=chat_id, photo=image_url, caption=message)
+        else:
+            await bot.send_photo(chat_id=chat_id, photo=image_url)
+            await send_text(bot, chat_id, message)
         print("Notification Telegram avec image envoyée avec succès")
     except Exception as e:
         print(f"Erreur lors de l'envoi de la notification Telegram: {e}")
@@ -171,7 +238,7 @@ async def send_telegram_notification(message, image_url, chat_id, token):
         # Essayer d'envoyer juste le message et l'URL de l'image en cas d'échec
         try:
             message_with_url = f"{message}\n\nImage: {image_url}"
-            await bot.send_message(chat_id=chat_id, text=message_with_url)
+            await send_text(bot, chat_id, message_with_url)
             print("Message Telegram avec URL de l'image envoyé avec succès")
         except Exception as e2:
             print(f"Erreur lors de l'envoi du message Telegram: {e2}")
@@ -183,7 +250,7 @@ if __name__ == "__main__":
     parser.add_argument("--aspect-ratio", default="ASPECT_1_1", 
                         choices=["ASPECT_1_1", "ASPECT_16_9", "ASPECT_9_16", "ASPECT_4_3", "ASPECT_3_4"],
                         help="Ratio d'aspect de l'image")
-    parser.add_argument("--model", default="V_2A", choices=["V_1", "V_2", "V_2A"], help="Modèle à utiliser")
+    parser.add_argument("--model", choices=["V_1", "V_2", "V_2A"], help="Modèle à utiliser (par défaut le réglage image_model)")
     parser.add_argument("--magic-prompt", default="AUTO", 
                         choices=["AUTO", "NONE", "LOW", "MEDIUM", "HIGH", "VERY_HIGH"],
                         help="Option de prompt magique")
@@ -194,22 +261,31 @@ if __name__ == "__main__":
     args = parser.parse_args()
     
     # Paramètres pour Simba
-    blueprint_id = "simba"
-    kin_id = "simba"
-    
-    # Générer l'image
-    print(f"Génération de l'image avec le message: {args.message}")
-    result = generate_image(
-        blueprint_id=blueprint_id,
-        kin_id=kin_id,
-        message=args.message,
-        aspect_ratio=args.aspect_ratio,
-        model=args.model,
-        magic_prompt_option=args.magic_prompt
-    )
-    
-    # Traiter le résultat
-    if result:
+    settings = get_settings()
+    blueprint_id = settings.blueprint_id
+    kin_id = settings.kin_id
+    
+    telegram_token = settings.telegram_bot_token
+    # Les notifications partent vers le premier chat autorisé
+    telegram_chat_id = next((c for c in settings.telegram_chat_id or [] if c != "*"), None)
+    notify = not args.no_telegram and telegram_token and telegram_chat_id
+    
+    def draw():
+        """Génère l'image, l'envoie au Kin si demandé et retourne son URL."""
+        # Générer l'image
+        print(f"Génération de l'image avec le message: {args.message}")
+        result = generate_image(
+            blueprint_id=blueprint_id,
+            kin_id=kin_id,
+            message=args.message,
+            aspect_ratio=args.aspect_ratio,
+            model=args.model,
+            magic_prompt_option=args.magic_prompt
+        )
+        if not result:
+            print("Échec de la génération de l'image")
+            return None
+        
         print("\nImage générée avec succès:")
         print("-" * 50)
         print(f"ID: {result.get('id')}")
@@ -226,48 +302,42 @@ if __name__ == "__main__":
         if not image_url and 'result' in result and 'data' in result['result'] and len(result['result']['data']) > 0:
             image_url = result['result']['data'][0].get('url')
         
-        if image_url:
-            print(f"URL de l'image: {image_url}")
-            print(f"Chemin local: {local_path}")
-            
-            # Envoyer l'image à Simba si demandé
-            if not args.no_send_to_kin:
-                print("\nEnvoi de l'image à Simba...")
-                message_result = send_message_with_image(
-                    blueprint_id=blueprint_id,
-                    kin_id=kin_id,
-                    content=args.caption,
-                    image_url=image_url
-                )
-                
-                if message_result:
-                    # Vérifier si la réponse contient du contenu
-                    content = message_result.get("response") or message_result.get("content")
-                    if content:
-                        print("\nRéponse de Simba:")
-                        print("-" * 50)
-                        print(content)
-                        print("-" * 50)
-                    else:
-                        print("Pas de réponse de Simba")
-                else:
-                    print("Échec de l'envoi du message avec image à Simba")
+        if not image_url:
+            print("URL de l'image non trouvée dans la réponse")
+            return None
+        
+        print(f"URL de l'image: {image_url}")
+        print(f"Chemin local: {local_path}")
+        
+        # Envoyer l'image à Simba si demandé
+        if not args.no_send_to_kin:
+            print("\nEnvoi de l'image à Simba...")
+            message_result = send_message_with_image(
+                blueprint_id=blueprint_id,
+                kin_id=kin_id,
+                content=args.caption,
+                image_url=image_url
+            )
             
-            # Envoyer la notification Telegram si activée
-            if not args.no_telegram:
-                # Récupérer les informations Telegram depuis les variables d'environnement
-                telegram_token = os.getenv("TELEGRAM_BOT_TOKEN")
-                telegram_chat_id = os.getenv("TELEGRAM_CHAT_ID")
-                
-                if telegram_token and telegram_chat_id:
-                    # Préparer le message pour Telegram
-                    telegram_message = f"Simba a dessiné: {args.message}"
-                    
-                    # Envoyer la notification Telegram de manière asynchrone
-                    asyncio.run(send_telegram_notification(telegram_message, image_url, telegram_chat_id, telegram_token))
+            if message_result:
+                # Vérifier si la réponse contient du contenu
+                content = message_result.get("response") or message_result.get("content")
+                if content:
+                    print("\nRéponse de Simba:")
+                    print("-" * 50)
+                    print(content)
+                    print("-" * 50)
                 else:
-                    print("Variables d'environnement TELEGRAM_BOT_TOKEN et/ou TELEGRAM_CHAT_ID non définies")
-        else:
-            print("URL de l'image non trouvée dans la réponse")
+                    print("Pas de réponse de Simba")
+            else:
+                print("Échec de l'envoi du message avec image à Simba")
+        return image_url
+    
+    if notify:
+        # Le chat voit « envoie une photo » jusqu'à l'envoi de la photo
+        import asyncio
+        asyncio.run(draw_with_indicator(telegram_token, telegram_chat_id, draw, f"Simba a dessiné: {args.message}"))
     else:
-        print("Échec de la génération de l'image")
+        image_url = draw()
+        if image_url and not args.no_telegram:
+            print("Variables d'environnement TELEGRAM_BOT_TOKEN et/ou TELEGRAM_CHAT_ID non définies")
@@ -0,0 +1,151 @@
+import os
+import time
+import json
+import hashlib
+import sqlite3
+import asyncio
+import logging
+from collections import OrderedDict
+from settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Durées de rétention ; le nombre de clés gardées en mémoire est le réglage idempotency_max_entries
+DEFAULT_UPDATE_TTL = 24 * 3600   # Telegram peut renvoyer une mise à jour longtemps après
+DEFAULT_PAYLOAD_TTL = 30         # Fenêtre pour les doubles envois d'un même contenu
+
+def update_key(update):
+    """
+    Clé d'idempotence d'une mise à jour Telegram.
+
+    Returns:
+        str: Clé basée sur `update_id`, ou sur le couple chat/message à défaut
+    """
+    if getattr(update, "update_id", None) is not None:
+        return f"update:{update.update_id}"
+    return f"message:{update.effective_chat.id}:{update.effective_message.message_id}"
+
+def payload_key(chat_id, content, images=None):
+    """
+    Clé d'idempotence basée sur le contenu envoyé à KinOS.
+
+    Returns:
+        str: Empreinte SHA-256 du chat, du texte et des images
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps([str(chat_id), content], ensure_ascii=False).encode("utf-8"))
+    for image in images or []:
+        digest.update(hashlib.sha256(image.encode("utf-8")).digest())
+    return f"payload:{digest.hexdigest()}"
+
+class IdempotencyStore:
+    """
+    Déduplication des requêtes sortantes.
+
+    Les clés déjà traitées sont gardées dans un ensemble borné en mémoire
+    (les plus anciennes sont oubliées en premier), avec une persistance
+    SQLite optionnelle pour survivre à un redémarrage. Les requêtes
+    identiques en cours partagent un même futur : une seule part vers KinOS.
+    """
+
+    def __init__(self, max_entries=None, db_path=None):
+        self._max_entries = max_entries
+        self._done = OrderedDict()   # clé -> (expiration, résultat)
+        self._inflight = {}          # clé -> asyncio.Future
+        self._db = None
+
+        db_path = db_path or os.getenv("SIMBA_IDEMPOTENCY_DB")
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS idempotency_keys ("
+                "key TEXT PRIMARY KEY, expires_at REAL NOT NULL)"
+            )
+            self._db.execute("DELETE FROM idempotency_keys WHERE expires_at < ?", (time.time(),))
+            self._db.commit()
+
+    @property
+    def max_entries(self):
+        """Nombre de clés gardées en mémoire (réglage idempotency_max_entries, modifiable à chaud)."""
+        return self._max_entries or get_settings().idempotency_max_entries
+
+    def seen(self, key):
+        """Indique si une clé a déjà été traitée et n'a pas expiré."""
+        now = time.time()
+        entry = self._done.get(key)
+        if entry:
+            if entry[0] >= now:
+                return True
+            del self._done[key]
+        if self._db:
+            row = self._db.execute(
+                "SELECT expires_at FROM idempotency_keys WHERE key = ?", (key,)
+            ).fetchone()
+            return bool(row and row[0] >= now)
+        return False
+
+    def mark(self, key, ttl, result=None):
+        """Enregistre une clé comme traitée pendant `ttl` secondes."""
+        expires_at = time.time() + ttl
+        self._done[key] = (expires_at, result)
+        self._done.move_to_end(key)
+        while len(self._done) > self.max_entries:
+            self._done.popitem(last=False)
+        if self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO idempotency_keys (key, expires_at) VALUES (?, ?)",
+                (key, expires_at)
+            )
+            self._db.commit()
+
+    async def run(self, key, factory, ttl=DEFAULT_PAYLOAD_TTL):
+        """
+        Exécute `factory()` une seule fois pour une clé donnée.
+
+        Args:
+            key (str): La clé d'idempotence
+            factory (callable): Fonction retournant la coroutine à exécuter
+            ttl (float, optional): Durée pendant laquelle la clé reste connue, en secondes
+
+        Returns:
+            tuple: (résultat, doublon) où `doublon` vaut True si la requête
+            avait déjà été traitée ou était en cours. Le résultat d'un doublon
+            peut être None si seule la clé persistée est connue, ou si la
+            requête en cours a échoué.
+
+        Raises:
+            Exception: L'exception levée par `factory()`, qui n'est pas mémorisée
+        """
+        if key in self._inflight:
+            logger.info(f"Requête identique en cours, résultat partagé: {key}")
+            try:
+                return await asyncio.shield(self._inflight[key]), True
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # L'échec est signalé par la requête d'origine, pas par chaque doublon
+                return None, True
+
+        if self.seen(key):
+            logger.info(f"Requête déjà traitée, ignorée: {key}")
+            entry = self._done.get(key)
+            return (entry[1] if entry else None), True
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await factory()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            # Un échec n'est pas mémorisé : la requête pourra être retentée
+            future.set_exception(e)
+            future.exception()  # Évite l'avertissement "exception never retrieved"
+            raise
+        else:
+            self.mark(key, ttl, result)
+            future.set_result(result)
+            return result, False
+        finally:
+            del self._inflight[key]
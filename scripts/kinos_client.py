@@ -0,0 +1,236 @@
+import re
+import json
+import time
+import threading
+import logging
+import functools
+import requests
+import concurrent.futures
+from requests.adapters import HTTPAdapter
+from usage_accounting import get_accountant, count_tokens
+from traffic_capture import get_recorder
+from latency import get_estimator
+from settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+# URL de base de l'API (modifiable pour pointer vers un serveur local de test)
+KINOS_API_BASE = get_settings().kinos_api_base
+
+CONNECT_TIMEOUT = 10
+
+_session = None
+_executor = None
+_init_lock = threading.Lock()  # Premiers appels possibles depuis plusieurs threads
+
+# Appels en cours, pour la limite de concurrence (modifiable à chaud)
+_slots = threading.Condition()
+_active = 0
+
+_URL_PATTERN = re.compile(r"/blueprints/(?P<blueprint>[^/]+)(?:/kins/(?P<kin>[^/]+))?(?:/(?P<endpoint>[^/?]+))?")
+
+def parse_url(api_url):
+    """
+    Extrait le blueprint, le kin et l'endpoint d'une URL KinOS.
+
+    Returns:
+        tuple: (blueprint_id, kin_id, endpoint), chaque élément pouvant valoir None
+    """
+    match = _URL_PATTERN.search(api_url)
+    if not match:
+        return None, None, None
+    return match.group("blueprint"), match.group("kin"), match.group("endpoint")
+
+def get_session():
+    """
+    Retourne la session HTTP partagée.
+
+    Les connexions (TCP et TLS) vers KinOS sont conservées dans un pool et
+    réutilisées d'un appel à l'autre, au lieu d'être rouvertes à chaque requête.
+    """
+    global _session
+    if _session is None:
+        with _init_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=2, pool_maxsize=get_settings().kinos_pool_size)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _init_lock:
+            if _executor is None:
+                _executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=get_settings().kinos_pool_size, thread_name_prefix="kinos"
+                )
+    return _executor
+
+def ping():
+    """
+    Ouvre (ou maintient) une connexion vers KinOS sans appeler de modèle.
+
+    Returns:
+        float: La durée de la requête, en secondes
+    """
+    start = time.monotonic()
+    get_session().head(KINOS_API_BASE, timeout=10)
+    return time.monotonic() - start
+
+def _acquire_slot():
+    """Attend une place libre sous la limite kinos_max_concurrency (relue à chaque appel)."""
+    global _active
+    with _slots:
+        while 0 < get_settings().kinos_max_concurrency <= _active:
+            _slots.wait(timeout=1)
+        _active += 1
+
+def _release_slot():
+    global _active
+    with _slots:
+        _active -= 1
+        _slots.notify()
+
+def _send(api_url, headers, payload, endpoint, model):
+    """
+    Envoie une requête avec le délai d'attente adapté à l'endpoint et au modèle.
+
+    Returns:
+        tuple: (réponse, corps envoyé, durée en secondes)
+
+    Raises:
+        requests.exceptions.Timeout: Si KinOS ne répond pas dans le délai
+    """
+    estimator = get_estimator()
+    timeout = estimator.timeout(endpoint, model)
+    body = json.dumps(payload).encode("utf-8")
+    _acquire_slot()
+    start = time.monotonic()
+    try:
+        response = get_session().post(api_url, headers=headers, data=body, timeout=(CONNECT_TIMEOUT, timeout))
+    except requests.exceptions.Timeout:
+        # Un délai dépassé compte comme une mesure : l'estimation s'adapte à un KinOS plus lent
+        estimator.record(endpoint, model, time.monotonic() - start)
+        logger.warning(f"KinOS n'a pas répondu en {timeout:.0f} s ({endpoint}, {model})")
+        raise
+    finally:
+        _release_slot()
+    duration = time.monotonic() - start
+    estimator.record(endpoint, model, duration)
+    return response, body, duration
+
+def _discard(on_discarded, payload, future):
+    if future.exception() is None:
+        on_discarded(future.result(), payload)
+
+def _send_hedged(api_url, headers, payload, endpoint, model, hedge_model, hedge_after, on_discarded):
+    """
+    Envoie une requête puis, si elle dépasse `hedge_after` secondes, un doublon sur `hedge_model`.
+
+    La première réponse exploitable l'emporte. requests ne permet pas
+    d'interrompre une requête en cours : la réponse perdante est ignorée
+    et passée à `on_discarded` pour être comptabilisée.
+
+    Returns:
+        tuple: (réponse, corps envoyé, durée en secondes, payload envoyé)
+    """
+    primary = _get_executor().submit(_send, api_url, headers, payload, endpoint, model)
+    try:
+        return primary.result(timeout=hedge_after) + (payload,)
+    except concurrent.futures.TimeoutError:
+        pass
+
+    logger.info(f"KinOS lent ({endpoint}, {model}) après {hedge_after:.1f} s: requête doublée sur {hedge_model}")
+    hedge_payload = dict(payload, model=hedge_model)
+    hedge = _get_executor().submit(_send, api_url, headers, hedge_payload, endpoint, hedge_model)
+    pending = {primary: payload, hedge: hedge_payload}
+    error = None
+    while pending:
+        done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            sent_payload = pending.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                error = e
+                continue
+            # Une erreur serveur ne l'emporte que s'il ne reste aucune autre requête
+            if result[0].status_code >= 500 and pending:
+                error = None
+                on_discarded(result, sent_payload)
+                continue
+            for other, other_payload in pending.items():
+                if not other.cancel():
+                    other.add_done_callback(functools.partial(_discard, on_discarded, other_payload))
+            return result + (sent_payload,)
+    raise error
+
+def post(api_url, headers, payload, chat_id=None):
+    """
+    Point de passage commun des requêtes POST vers KinOS.
+
+    La requête passe par le contrôle d'admission budgétaire (qui peut la
+    dégrader ou la refuser), puis sa consommation est comptabilisée par
+    chat, kin et endpoint. Le délai d'attente suit la latence observée de
+    l'endpoint et du modèle ; sur les endpoints de `hedge_endpoints`, une
+    requête plus lente que le p95 est doublée sur `hedge_model`.
+
+    Args:
+        api_url (str): L'URL de l'endpoint KinOS
+        headers (dict): Les headers de la requête
+        payload (dict): Le corps de la requête
+        chat_id (str, optional): Le chat à l'origine de la requête. Par défaut "cli"
+
+    Returns:
+        requests.Response: La réponse HTTP
+
+    Raises:
+        BudgetExceededError: Si le budget quotidien est épuisé
+        requests.exceptions.Timeout: Si KinOS ne répond pas dans le délai
+    """
+    _, kin_id, endpoint = parse_url(api_url)
+    chat_id = str(chat_id) if chat_id is not None else "cli"
+    kin_id = kin_id or "-"
+    endpoint = endpoint or "-"
+
+    accountant = get_accountant()
+    payload = accountant.admit(chat_id, kin_id, endpoint, payload)
+    model = payload.get("model") or "-"
+
+    def account(result, sent_payload):
+        response, body, _ = result
+        try:
+            tokens = count_tokens(response.json())
+        except ValueError:
+            tokens = 0
+        images = len(sent_payload.get("images") or []) + (1 if endpoint == "images" else 0)
+        accountant.record(
+            chat_id, kin_id, endpoint,
+            images=images,
+            request_bytes=len(body),
+            response_bytes=len(response.content),
+            tokens=tokens
+        )
+
+    settings = get_settings()
+    hedge_model = settings.hedge_model
+    hedge_after = None
+    if hedge_model and endpoint in settings.hedge_endpoints and model != hedge_model:
+        hedge_after = get_estimator().percentile(endpoint, model, 0.95)
+
+    if hedge_after is None:
+        response, body, duration = _send(api_url, headers, payload, endpoint, model)
+    else:
+        response, body, duration, payload = _send_hedged(
+            api_url, headers, payload, endpoint, model, hedge_model, hedge_after, account
+        )
+
+    recorder = get_recorder()
+    if recorder:
+        recorder.record_kinos(api_url, payload, response, duration)
+
+    account((response, body, duration), payload)
+    return response
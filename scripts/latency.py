@@ -0,0 +1,116 @@
+import os
+import json
+import atexit
+import logging
+import threading
+import collections
+from settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Emplacement par défaut des mesures (modifiable via l'environnement)
+DEFAULT_LATENCY_PATH = os.path.join(os.path.expanduser("~"), ".local", "share", "simba", "latency.json")
+
+# Nombre de mesures avant d'adapter les délais (bornés par kinos_min_timeout et kinos_timeout)
+MIN_SAMPLES = 20
+TIMEOUT_PERCENTILE = 0.99
+TIMEOUT_FACTOR = 1.5
+SAVE_EVERY = 20
+
+class LatencyEstimator:
+    """
+    Estimation glissante de la latence de KinOS par endpoint et par modèle.
+
+    Les dernières durées mesurées donnent des percentiles, dont on tire un
+    délai d'attente adapté à chaque couple (endpoint, modèle) : un appel
+    anormalement long est abandonné au lieu de bloquer l'utilisateur. Les
+    mesures sont conservées dans un fichier JSON pour que les scripts en
+    ligne de commande, qui ne font qu'un appel, en profitent aussi.
+    """
+
+    def __init__(self, path=None, window=None):
+        self.path = path or os.getenv("SIMBA_LATENCY_PATH", DEFAULT_LATENCY_PATH)
+        self.window = window or get_settings().latency_window
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._samples = collections.defaultdict(lambda: collections.deque(maxlen=self.window))
+        self._unsaved = 0
+        self._load()
+        atexit.register(self.save)
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as latency_file:
+                data = json.load(latency_file)
+        except (FileNotFoundError, ValueError):
+            return
+        for key, samples in data.items():
+            self._samples[key].extend(samples)
+
+    def save(self):
+        """Écrit les mesures sur disque."""
+        with self._lock:
+            if not self._unsaved:
+                return
+            data = {key: list(samples) for key, samples in self._samples.items()}
+            self._unsaved = 0
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._save_lock:
+            temporary_path = f"{self.path}.tmp"
+            with open(temporary_path, "w", encoding="utf-8") as latency_file:
+                json.dump(data, latency_file)
+            os.replace(temporary_path, self.path)
+
+    def record(self, endpoint, model, duration):
+        """Ajoute une durée mesurée (en secondes) pour un endpoint et un modèle."""
+        with self._lock:
+            self._samples[f"{endpoint}:{model}"].append(round(duration, 3))
+            self._unsaved += 1
+            due = self._unsaved >= SAVE_EVERY
+        if due:
+            try:
+                self.save()
+            except OSError as e:
+                logger.warning(f"Impossible d'enregistrer les mesures de latence: {e}")
+
+    def percentile(self, endpoint, model, fraction):
+        """
+        Retourne un percentile de la latence, ou None sans assez de mesures.
+
+        Args:
+            endpoint (str): L'endpoint KinOS
+            model (str): Le modèle
+            fraction (float): Le percentile voulu, entre 0 et 1 (0.95 pour p95)
+        """
+        with self._lock:
+            samples = sorted(self._samples.get(f"{endpoint}:{model}", ()))
+        if len(samples) < MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+    def timeout(self, endpoint, model):
+        """
+        Retourne le délai d'attente à appliquer, en secondes.
+
+        Sans assez de mesures, le délai par défaut s'applique ; sinon le p99
+        avec une marge, borné entre kinos_min_timeout et kinos_timeout.
+        """
+        settings = get_settings()
+        p99 = self.percentile(endpoint, model, TIMEOUT_PERCENTILE)
+        if p99 is None:
+            return settings.kinos_timeout
+        return min(settings.kinos_timeout, max(settings.kinos_min_timeout, p99 * TIMEOUT_FACTOR))
+
+_default_estimator = None
+_default_lock = threading.Lock()
+
+def get_estimator():
+    """Retourne l'instance partagée de l'estimation de latence (une seule, même appelée depuis plusieurs threads)."""
+    global _default_estimator
+    if _default_estimator is None:
+        with _default_lock:
+            if _default_estimator is None:
+                _default_estimator = LatencyEstimator()
+    return _default_estimator
@@ -0,0 +1,348 @@
+import os
+import hashlib
+import tempfile
+import threading
+from settings import get_settings
+
+# Emplacement du cache (modifiable via l'environnement) ; sa taille est le réglage cache_max_bytes
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "simba", "media")
+
+# Taille des morceaux écrits quand une variante est fournie sous forme de texte
+WRITE_CHUNK = 1024 * 1024
+
+# Une éviction redescend sous cette fraction de la taille maximale, pour ne pas
+# reparcourir le cache à chaque écriture une fois la limite atteinte
+EVICT_TARGET = 0.9
+
+def _is_digest(key):
+    return len(key) == 64 and all(c in "0123456789abcdef" for c in key)
+
+class MediaCache:
+    """
+    Cache disque adressé par contenu pour les images et fichiers téléchargés.
+
+    Les blobs sont indexés par leur empreinte SHA-256. Des alias (URL d'image,
+    `file_unique_id` Telegram...) pointent vers une empreinte, ce qui permet
+    d'éviter un téléchargement quand le même contenu revient. Les variantes
+    dérivées d'un blob (par exemple l'URL data en base64) sont stockées à côté
+    pour éviter de refaire l'encodage.
+
+    L'éviction est de type LRU : chaque lecture met à jour la date de
+    modification du fichier, et les fichiers les plus anciens sont supprimés
+    dès que la taille totale dépasse `max_bytes`. La taille totale est tenue
+    à jour à chaque écriture : le cache n'est parcouru qu'à l'ouverture et
+    lors d'une éviction. Les alias d'un blob évincé sont supprimés avec lui.
+    """
+
+    def __init__(self, directory=None, max_bytes=None):
+        self.directory = directory or os.getenv("SIMBA_CACHE_DIR", DEFAULT_CACHE_DIR)
+        self._max_bytes = max_bytes
+        self._blobs = os.path.join(self.directory, "blobs")
+        self._variants = os.path.join(self.directory, "variants")
+        self._aliases = os.path.join(self.directory, "aliases")
+        for path in (self._blobs, self._variants, self._aliases):
+            os.makedirs(path, exist_ok=True)
+        self._lock = threading.Lock()
+        self._size = sum(size for _, size, _ in self._scan(self._blobs) + self._scan(self._variants))
+
+    @property
+    def max_bytes(self):
+        """Taille maximale du cache (réglage cache_max_bytes, modifiable à chaud)."""
+        return self._max_bytes or get_settings().cache_max_bytes
+
+    @staticmethod
+    def digest(data):
+        """Retourne l'empreinte SHA-256 (hexadécimale) d'un contenu."""
+        return hashlib.sha256(data).hexdigest()
+
+    def _alias_path(self, alias):
+        # Les alias peuvent être des URLs : on les hache pour obtenir un nom de fichier sûr
+        return os.path.join(self._aliases, hashlib.sha256(alias.encode("utf-8")).hexdigest())
+
+    def _variant_path(self, digest, name):
+        return os.path.join(self._variants, f"{digest}.{name}")
+
+    def resolve(self, key):
+        """
+        Retourne l'empreinte associée à une clé (empreinte SHA-256 ou alias),
+        ou None si le contenu n'est pas en cache.
+        """
+        if _is_digest(key) and os.path.exists(os.path.join(self._blobs, key)):
+            return key
+        try:
+            with open(self._alias_path(key), "r") as alias_file:
+                digest = alias_file.read().strip()
+        except OSError:
+            return None
+        if os.path.exists(os.path.join(self._blobs, digest)):
+            return digest
+        # Alias orphelin : le blob a été évincé
+        self._remove(self._alias_path(key))
+        return None
+
+    def get(self, key):
+        """
+        Lit un blob depuis le cache.
+
+        Args:
+            key (str): Empreinte SHA-256 ou alias
+
+        Returns:
+            bytes: Le contenu, ou None s'il n'est pas en cache
+        """
+        digest = self.resolve(key)
+        if not digest:
+            return None
+        return self._read(os.path.join(self._blobs, digest))
+
+    def put(self, data, aliases=()):
+        """
+        Enregistre un blob et ses alias.
+
+        Args:
+            data (bytes): Le contenu à enregistrer
+            aliases (iterable, optional): Clés alternatives pointant vers ce contenu
+
+        Returns:
+            str: L'empreinte SHA-256 du contenu
+        """
+        digest = self.digest(data)
+        path = os.path.join(self._blobs, digest)
+        if os.path.exists(path):
+            self._touch(path)
+        else:
+            self._write(path, data)
+            self._grow(len(data))
+        for alias in aliases:
+            if alias:
+                self._write(self._alias_path(alias), digest.encode("utf-8"))
+        self._evict()
+        return digest
+
+    def open(self, key):
+        """
+        Ouvre un blob en lecture sans le charger entièrement en mémoire.
+
+        Returns:
+            file: Le fichier ouvert en mode binaire, ou None s'il n'est pas en cache
+        """
+        digest = self.resolve(key)
+        if not digest:
+            return None
+        path = os.path.join(self._blobs, digest)
+        try:
+            blob = open(path, "rb")
+        except OSError:
+            return None
+        self._touch(path)
+        return blob
+
+    def put_stream(self, fileobj, aliases=(), chunk_size=64 * 1024):
+        """
+        Enregistre un blob lu par morceaux depuis un fichier.
+
+        Le contenu est haché pendant la copie : la mémoire utilisée reste
+        bornée quelle que soit la taille du fichier.
+
+        Returns:
+            str: L'empreinte SHA-256 du contenu
+        """
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self._blobs)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                while True:
+                    chunk = fileobj.read(chunk_size)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+            digest = digest.hexdigest()
+            path = os.path.join(self._blobs, digest)
+            if os.path.exists(path):
+                self._remove(tmp_path)
+                self._touch(path)
+            else:
+                os.replace(tmp_path, path)
+                self._grow(size)
+        except OSError:
+            self._remove(tmp_path)
+            raise
+        for alias in aliases:
+            if alias:
+                self._write(self._alias_path(alias), digest.encode("utf-8"))
+        self._evict()
+        return digest
+
+    def get_variant(self, key, name):
+        """
+        Lit une variante dérivée d'un blob (par exemple "data_url").
+
+        Returns:
+            bytes: Le contenu de la variante, ou None si elle n'est pas en cache
+        """
+        digest = self.resolve(key)
+        if not digest:
+            return None
+        data = self._read(self._variant_path(digest, name))
+        if data is not None:
+            # L'éviction se fait par blob : un accès à une variante compte comme un accès au blob
+            self._touch(os.path.join(self._blobs, digest))
+        return data
+
+    def put_variant(self, key, name, data):
+        """
+        Enregistre une variante dérivée d'un blob déjà présent dans le cache.
+
+        Args:
+            key (str): Empreinte SHA-256 ou alias du blob
+            name (str): Le nom de la variante
+            data (bytes | str): Le contenu ; un texte est encodé en UTF-8 par morceaux
+
+        Returns:
+            bool: True si la variante a été enregistrée
+        """
+        digest = self.resolve(key)
+        if not digest:
+            return False
+        path = self._variant_path(digest, name)
+        try:
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = 0
+        self._write(path, data)
+        try:
+            self._grow(os.path.getsize(path) - replaced)
+        except OSError:
+            pass
+        self._evict()
+        return True
+
+    def _read(self, path):
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        self._touch(path)
+        return data
+
+    def _write(self, path, data):
+        # Écriture atomique pour ne jamais exposer un fichier partiel
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                if isinstance(data, str):
+                    # Pas de copie complète en octets d'un long texte (URL data)
+                    for start in range(0, len(data), WRITE_CHUNK):
+                        f.write(data[start:start + WRITE_CHUNK].encode("utf-8"))
+                else:
+                    f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            self._remove(tmp_path)
+            raise
+
+    @staticmethod
+    def _touch(path):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _grow(self, delta):
+        with self._lock:
+            self._size += delta
+
+    @staticmethod
+    def _scan(folder):
+        """Retourne (date de modification, taille, chemin) pour chaque fichier d'un dossier."""
+        entries = []
+        for entry in os.scandir(folder):
+            if entry.name.startswith("tmp"):
+                continue  # Écriture en cours
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _evict(self):
+        """Supprime les fichiers les moins récemment utilisés au-delà de la taille maximale."""
+        if self._size <= self.max_bytes:
+            return
+        with self._lock:
+            # Le total est recalculé : d'autres processus partagent peut-être le dossier
+            blobs = self._scan(self._blobs)
+            variants = {}
+            for entry in self._scan(self._variants):
+                digest = os.path.basename(entry[2]).partition(".")[0]
+                variants.setdefault(digest, []).append(entry)
+
+            # Variantes orphelines (blob déjà supprimé) : elles n'ont plus d'usage
+            present = {os.path.basename(path) for _, _, path in blobs}
+            for digest in [digest for digest in variants if digest not in present]:
+                for _, _, variant_path in variants.pop(digest):
+                    self._remove(variant_path)
+
+            total = sum(size for _, size, _ in blobs) + sum(
+                size for entries in variants.values() for _, size, _ in entries
+            )
+
+            # Les variantes suivent leur blob : on évince par blob, le moins récemment
+            # utilisé d'abord (dernier accès au blob ou à l'une de ses variantes)
+            def last_used(entry):
+                mtime, _, path = entry
+                return max([mtime] + [variant[0] for variant in variants.get(os.path.basename(path), ())])
+
+            target = self.max_bytes * EVICT_TARGET
+            evicted = set()
+            for _, size, path in sorted(blobs, key=last_used):
+                if total <= target:
+                    break
+                digest = os.path.basename(path)
+                self._remove(path)
+                total -= size
+                for _, variant_size, variant_path in variants.pop(digest, ()):
+                    self._remove(variant_path)
+                    total -= variant_size
+                evicted.add(digest)
+            self._size = total
+
+        if evicted:
+            self._remove_aliases(evicted)
+
+    def _remove_aliases(self, digests):
+        """Supprime les alias qui pointent vers des blobs évincés."""
+        for entry in os.scandir(self._aliases):
+            if entry.name.startswith("tmp"):
+                continue
+            try:
+                with open(entry.path, "r") as alias_file:
+                    target = alias_file.read().strip()
+            except OSError:
+                continue
+            if target in digests:
+                self._remove(entry.path)
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+def get_cache():
+    """Retourne l'instance partagée du cache média (une seule, même appelée depuis plusieurs threads)."""
+    global _default_cache
+    if _default_cache is None:
+        with _default_lock:
+            if _default_cache is None:
+                _default_cache = MediaCache()
+    return _default_cache
@@ -0,0 +1,176 @@
+import base64
+import asyncio
+import logging
+import tempfile
+from urllib.parse import urlparse
+from media_cache import get_cache
+from settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Les limites de mémoire et de taille sont les réglages media_max_bytes, media_spool_bytes
+# et media_max_concurrency
+CHUNK_SIZE = 64 * 1024
+
+# Types de documents transmis à KinOS comme pièces jointes
+ATTACHMENT_MIME_TYPES = ("application/pdf", "text/")
+
+class MediaTooLargeError(ValueError):
+    """Le fichier dépasse la taille maximale acceptée."""
+
+_http_client = None  # (boucle, httpx.AsyncClient)
+
+def _get_http_client():
+    """
+    Client HTTP partagé par les téléchargements : ses connexions vers
+    Telegram restent ouvertes d'un média à l'autre (recréé si la boucle change).
+    """
+    global _http_client
+    import httpx
+    loop = asyncio.get_running_loop()
+    if _http_client is None or _http_client[0] is not loop or _http_client[1].is_closed:
+        _http_client = (loop, httpx.AsyncClient(timeout=60))
+    return _http_client[1]
+
+async def close_http_client():
+    """Ferme le client HTTP partagé, s'il a été créé."""
+    global _http_client
+    if _http_client is not None:
+        client = _http_client[1]
+        _http_client = None
+        await client.aclose()
+
+async def download_to_spool(telegram_file, max_bytes=None, spool_bytes=None):
+    """
+    Télécharge un fichier Telegram par morceaux.
+
+    Le contenu reste en mémoire tant qu'il est petit, puis bascule dans un
+    fichier temporaire au-delà de `spool_bytes` : la mémoire utilisée par une
+    mise à jour reste bornée, contrairement à `download_as_bytearray`.
+
+    Args:
+        telegram_file (telegram.File): Le fichier retourné par `get_file`
+        max_bytes (int, optional): Taille maximale acceptée
+        spool_bytes (int, optional): Taille au-delà de laquelle le contenu est écrit sur disque
+
+    Returns:
+        SpooledTemporaryFile: Le contenu, positionné au début
+
+    Raises:
+        MediaTooLargeError: Si le fichier dépasse `max_bytes`
+    """
+    settings = get_settings()
+    max_bytes = max_bytes or settings.media_max_bytes
+    if telegram_file.file_size and telegram_file.file_size > max_bytes:
+        raise MediaTooLargeError(f"Fichier trop volumineux: {telegram_file.file_size} octets")
+
+    spool = tempfile.SpooledTemporaryFile(max_size=spool_bytes or settings.media_spool_bytes)
+    size = 0
+    try:
+        if urlparse(telegram_file.file_path).scheme in ("http", "https"):
+            async with _get_http_client().stream("GET", telegram_file.file_path) as response:
+                response.raise_for_status()
+                async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > max_bytes:
+                        raise MediaTooLargeError(f"Fichier trop volumineux: plus de {max_bytes} octets")
+                    spool.write(chunk)
+        else:
+            # Serveur Bot API local : le fichier est déjà sur le disque
+            with open(telegram_file.file_path, "rb") as local_file:
+                while True:
+                    chunk = local_file.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > max_bytes:
+                        raise MediaTooLargeError(f"Fichier trop volumineux: plus de {max_bytes} octets")
+                    spool.write(chunk)
+    except BaseException:
+        spool.close()
+        raise
+
+    spool.seek(0)
+    return spool
+
+_ingest_slots = None  # (limite, asyncio.Semaphore)
+
+def _ingest_semaphore():
+    """Sémaphore limitant les médias téléchargés et encodés en même temps (recréé si le réglage change)."""
+    global _ingest_slots
+    limit = get_settings().media_max_concurrency
+    if _ingest_slots is None or _ingest_slots[0] != limit:
+        _ingest_slots = (limit, asyncio.Semaphore(limit))
+    return _ingest_slots[1]
+
+def encode_data_url(fileobj, mime_type):
+    """
+    Encode un fichier en URL data base64, morceau par morceau.
+
+    Returns:
+        str: L'URL data
+    """
+    parts = [f"data:{mime_type};base64,"]
+    while True:
+        # Un multiple de 3 octets évite tout remplissage au milieu de l'encodage
+        chunk = fileobj.read(3 * CHUNK_SIZE)
+        if not chunk:
+            break
+        parts.append(base64.b64encode(chunk).decode("ascii"))
+    return "".join(parts)
+
+async def fetch_data_url(bot, media, mime_type):
+    """
+    Retourne un média Telegram sous forme d'URL data, en passant par le cache local.
+
+    Un média déjà reçu (même `file_unique_id`, par exemple un message
+    transféré) n'est ni retéléchargé ni réencodé. Une URL data occupe
+    plusieurs fois la taille du fichier en mémoire : le nombre de médias
+    traités en même temps est limité (réglage media_max_concurrency), et le
+    hachage, la copie et l'encodage tournent dans un thread pour ne pas
+    bloquer les autres chats.
+
+    Args:
+        bot (telegram.Bot): Le bot Telegram
+        media: L'objet média (PhotoSize, Document, Voice, Sticker...)
+        mime_type (str): Le type MIME à indiquer dans l'URL data
+
+    Returns:
+        str: L'URL data du média
+
+    Raises:
+        MediaTooLargeError: Si le média dépasse la taille maximale acceptée
+    """
+    cache = get_cache()
+    key = media.file_unique_id
+
+    async with _ingest_semaphore():
+        cached = await asyncio.to_thread(cache.get_variant, key, "data_url")
+        if cached:
+            logger.info(f"Média trouvé dans le cache local: {key}")
+            return cached.decode("utf-8")
+
+        blob = await asyncio.to_thread(cache.open, key)
+        if blob is None:
+            telegram_file = await bot.get_file(media.file_id)
+            with await download_to_spool(telegram_file) as spool:
+                data_url = await asyncio.to_thread(_store_and_encode, cache, spool, key, mime_type)
+        else:
+            with blob:
+                data_url = await asyncio.to_thread(encode_data_url, blob, mime_type)
+
+        await asyncio.to_thread(cache.put_variant, key, "data_url", data_url)
+    return data_url
+
+def _store_and_encode(cache, spool, key, mime_type):
+    cache.put_stream(spool, aliases=[key])
+    spool.seek(0)
+    return encode_data_url(spool, mime_type)
+
+def is_attachment_type(mime_type):
+    """Indique si un type de document est transmis à KinOS comme pièce jointe."""
+    return bool(mime_type) and mime_type.startswith(ATTACHMENT_MIME_TYPES)
+
+def is_image_type(mime_type):
+    """Indique si un type de document passe par le traitement des images."""
+    return bool(mime_type) and mime_type.startswith("image/")
@@ -0,0 +1,359 @@
+"""
+Rejoue hors ligne un trafic capturé avec SIMBA_CAPTURE_PATH.
+
+Usage :
+    python scripts/replay.py run capture.jsonl.gz [--speed 10] [--out avant.json]
+    python scripts/replay.py diff avant.json apres.json
+
+`run` envoie les mises à jour enregistrées au webhook du bot, aux mêmes
+intervalles (divisés par --speed), contre un serveur local qui simule
+Telegram et renvoie les réponses KinOS enregistrées avec leur durée
+d'origine. `diff` compare les réponses et les latences de deux exécutions,
+par exemple avant et après une modification.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import threading
+import collections
+from urllib.parse import parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from selftest import STUB_TOKEN, free_port
+from traffic_capture import read_capture
+
+class ReplayState:
+    """Réponses KinOS enregistrées et requêtes reçues par le serveur simulé."""
+
+    def __init__(self, records, speed):
+        self.speed = speed
+        self.lock = threading.Lock()
+        self.kinos = collections.defaultdict(collections.deque)
+        for record in records:
+            if record["type"] == "kinos":
+                self.kinos[record["path"]].append(record)
+        self.kinos_requests = []
+        self.kinos_missing = 0
+        self.messages = []
+        self.next_message_id = 1_000_000
+
+    def next_kinos(self, path):
+        with self.lock:
+            if self.kinos[path]:
+                return self.kinos[path].popleft()
+            self.kinos_missing += 1
+            return None
+
+    def record_message(self, method, params):
+        with self.lock:
+            self.next_message_id += 1
+            self.messages.append((time.monotonic(), method, params))
+            return self.next_message_id
+
+def parse_params(body, content_type):
+    """Décode les paramètres d'un appel à l'API Bot (formulaire ou JSON)."""
+    if "json" in (content_type or ""):
+        return json.loads(body or b"{}")
+    params = {}
+    if "form-urlencoded" in (content_type or ""):
+        for key, values in parse_qs(body.decode("utf-8"), keep_blank_values=True).items():
+            try:
+                params[key] = json.loads(values[0])
+            except ValueError:
+                params[key] = values[0]
+    return params
+
+def comparable_request(payload):
+    """Corps d'une requête KinOS sans le contenu des médias (qui diffère forcément au rejeu)."""
+    return {key: (len(value) if key in ("images", "attachments") else value)
+            for key, value in payload.items() if value}
+
+def make_replay_handler(state):
+    class ReplayHandler(BaseHTTPRequestHandler):
+        """Simule l'API Bot de Telegram et rejoue les réponses KinOS enregistrées."""
+
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _reply(self, status, body, content_type="application/json"):
+            data = body if isinstance(body, bytes) else json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_HEAD(self):
+            self.send_response(200)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def do_GET(self):
+            if self.path.startswith("/v2/"):
+                self._reply(200, [])
+            elif self.path.startswith("/file/"):
+                # Contenu factice de la taille demandée, pour les médias
+                size = int(self.path.rsplit("-", 1)[-1]) if "-" in self.path else 1024
+                self._reply(200, b"\0" * min(size, 1024 * 1024), "application/octet-stream")
+            else:
+                self._reply(404, {"error": "not found"})
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            if self.path.startswith("/v2/"):
+                payload = json.loads(body or b"{}")
+                path = self.path.split("/blueprints/", 1)[-1]
+                with state.lock:
+                    state.kinos_requests.append({"path": path, "request": comparable_request(payload)})
+                record = state.next_kinos(path)
+                if record is None:
+                    self._reply(200, {"response": "", "status": "missing"})
+                    return
+                time.sleep(record["duration"] / state.speed)
+                response = record["response"]
+                if isinstance(response, str):
+                    self._reply(record["status"], response.encode("utf-8"), "text/plain")
+                else:
+                    self._reply(record["status"], response)
+                return
+
+            method = self.path.rsplit("/", 1)[-1]
+            params = parse_params(body, self.headers.get("Content-Type"))
+            if method == "getMe":
+                result = {"id": 123456, "is_bot": True, "first_name": "Simba", "username": "simba_replay_bot"}
+            elif method == "getFile":
+                file_id = params.get("file_id", "file")
+                result = {"file_id": file_id, "file_unique_id": file_id, "file_size": 1024,
+                          "file_path": f"files/{file_id}-1024"}
+            elif method in ("sendMessage", "sendPhoto"):
+                message_id = state.record_message(method, params)
+                result = {"message_id": message_id, "date": int(time.time()),
+                          "chat": {"id": int(params.get("chat_id", 0)), "type": "private"},
+                          "text": str(params.get("text") or params.get("caption") or "")}
+            else:
+                result = True
+            self._reply(200, {"ok": True, "result": result})
+
+    return ReplayHandler
+
+def message_key(update):
+    message = update.get("message") or update.get("edited_message") or {}
+    return message.get("chat", {}).get("id"), message.get("message_id")
+
+def reply_target(params):
+    reply_to = params.get("reply_to_message_id")
+    if reply_to is None and isinstance(params.get("reply_parameters"), dict):
+        reply_to = params["reply_parameters"].get("message_id")
+    return params.get("chat_id"), reply_to
+
+async def wait_until_idle(application, tracker, timeout, quiet=1.0):
+    """Attend que le bot n'ait plus de mise à jour en file ni en cours pendant `quiet` secondes."""
+    deadline = time.monotonic() + timeout
+    idle_since = None
+    while time.monotonic() < deadline:
+        if application.update_queue.qsize() == 0 and len(tracker) == 0:
+            idle_since = idle_since or time.monotonic()
+            if time.monotonic() - idle_since >= quiet:
+                return True
+        else:
+            idle_since = None
+        await asyncio.sleep(0.05)
+    return False
+
+async def run_replay(capture_path, speed=1.0, max_gap=5.0, timeout=120):
+    """
+    Rejoue une capture contre le bot et retourne le résultat de l'exécution.
+
+    Args:
+        capture_path (str): Le fichier de capture
+        speed (float, optional): Facteur d'accélération (1 = vitesse d'origine)
+        max_gap (float, optional): Attente maximale entre deux mises à jour, en secondes d'origine
+        timeout (float, optional): Attente maximale de la fin du traitement, en secondes
+
+    Returns:
+        dict: Les réponses et latences par mise à jour, et les requêtes KinOS reçues
+    """
+    records = read_capture(capture_path)
+    updates = [record for record in records if record["type"] == "update"]
+    state = ReplayState(records, speed)
+    stub_port = free_port()
+    stub = ThreadingHTTPServer(("127.0.0.1", stub_port), make_replay_handler(state))
+    threading.Thread(target=stub.serve_forever, daemon=True).start()
+
+    # Pointer le bot vers le serveur simulé et isoler ses données locales
+    workdir = tempfile.mkdtemp(prefix="simba-replay-")
+    os.environ.update({
+        "SIMBA_KINOS_API_BASE": f"http://127.0.0.1:{stub_port}/v2",
+        "KINOS_API_KEY": "replay",
+        "TELEGRAM_BOT_TOKEN": STUB_TOKEN,
+        "TELEGRAM_CHAT_ID": "*",
+        "SIMBA_CACHE_DIR": os.path.join(workdir, "cache"),
+        "SIMBA_USAGE_DB": os.path.join(workdir, "usage.db"),
+        "SIMBA_PENDING_PATH": os.path.join(workdir, "pending.jsonl"),
+        "SIMBA_LATENCY_PATH": os.path.join(workdir, "latency.json"),
+        # Vide plutôt que retiré : load_dotenv ne la remet pas depuis .env
+        "SIMBA_CAPTURE_PATH": "",
+    })
+    for name in ("SIMBA_IDEMPOTENCY_DB", "TELEGRAM_WEBHOOK_SECRET"):
+        os.environ.pop(name, None)
+
+    import httpx
+    import logging
+    import telegram_bot
+    from webhook_server import serve_webhook
+    logging.getLogger().setLevel(logging.WARNING)
+
+    application = telegram_bot.build_application(
+        STUB_TOKEN,
+        base_url=f"http://127.0.0.1:{stub_port}/bot",
+        base_file_url=f"http://127.0.0.1:{stub_port}/file/bot"
+    )
+    port = free_port()
+    started, stopped = asyncio.Event(), asyncio.Event()
+    server = asyncio.create_task(serve_webhook(
+        application, telegram_bot.TRACKER,
+        webhook_url=None,
+        url_path="webhook",
+        port=port,
+        kinos_probe_url=f"{telegram_bot.kinos_client.KINOS_API_BASE}/blueprints/{telegram_bot.BLUEPRINT_ID}/kins",
+        kinos_api_key="replay",
+        listen="127.0.0.1",
+        install_signals=False,
+        started=started,
+        stopped=stopped
+    ))
+
+    posted = {}
+    try:
+        await asyncio.wait_for(started.wait(), 30)
+        async with httpx.AsyncClient(timeout=30) as client:
+            previous_t = updates[0]["t"] if updates else 0
+            for record in updates:
+                await asyncio.sleep(min(record["t"] - previous_t, max_gap) / speed)
+                previous_t = record["t"]
+                posted[message_key(record["update"])] = (time.monotonic(), record["update"])
+                await client.post(f"http://127.0.0.1:{port}/webhook", json=record["update"])
+        completed = await wait_until_idle(application, telegram_bot.TRACKER, timeout)
+    finally:
+        stopped.set()
+        await server
+        stub.shutdown()
+
+    outputs = collections.defaultdict(list)
+    for timestamp, method, params in state.messages:
+        outputs[reply_target(params)].append((timestamp, params.get("text") or params.get("caption") or ""))
+
+    results = []
+    for key, (sent_at, update) in posted.items():
+        message = update.get("message") or update.get("edited_message") or {}
+        replies = outputs.get(key, [])
+        results.append({
+            "update_id": update.get("update_id"),
+            "input": message.get("text") or message.get("caption") or "",
+            "outputs": [text for _, text in replies],
+            "latency_ms": round((replies[0][0] - sent_at) * 1000, 1) if replies else None,
+        })
+
+    recorded_requests = sorted(
+        json.dumps({"path": record["path"], "request": comparable_request(record["request"])}, sort_keys=True)
+        for record in records if record["type"] == "kinos"
+    )
+    replayed_requests = sorted(json.dumps(request, sort_keys=True) for request in state.kinos_requests)
+    return {
+        "capture": capture_path,
+        "speed": speed,
+        "completed": completed,
+        "updates": results,
+        "kinos_requests": replayed_requests,
+        "kinos_missing": state.kinos_missing,
+        "kinos_requests_changed": sum(
+            (collections.Counter(replayed_requests) - collections.Counter(recorded_requests)).values()
+        ),
+    }
+
+def percentile(values, fraction):
+    values = sorted(value for value in values if value is not None)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def print_run(result):
+    latencies = [entry["latency_ms"] for entry in result["updates"]]
+    answered = sum(1 for entry in result["updates"] if entry["outputs"])
+    print(f"Mises à jour rejouées: {len(result['updates'])} (avec réponse: {answered})")
+    print(f"Latence p50: {percentile(latencies, 0.5)} ms, p95: {percentile(latencies, 0.95)} ms")
+    print(f"Requêtes KinOS: {len(result['kinos_requests'])} "
+          f"(différentes de la capture: {result['kinos_requests_changed']}, "
+          f"sans réponse enregistrée: {result['kinos_missing']})")
+    if not result["completed"]:
+        print("Attention: le traitement n'était pas terminé à l'échéance")
+
+def diff_runs(before, after):
+    """
+    Compare deux exécutions et affiche les différences.
+
+    Returns:
+        int: Le nombre de mises à jour dont les réponses diffèrent
+    """
+    after_by_id = {entry["update_id"]: entry for entry in after["updates"]}
+    changed = 0
+    for entry in before["updates"]:
+        other = after_by_id.get(entry["update_id"])
+        if other is None:
+            print(f"- Mise à jour {entry['update_id']} absente de la seconde exécution")
+            changed += 1
+        elif entry["outputs"] != other["outputs"]:
+            changed += 1
+            print(f"\n~ Mise à jour {entry['update_id']}: {entry['input'][:60]!r}")
+            print(f"    avant: {entry['outputs']}")
+            print(f"    après: {other['outputs']}")
+
+    if before["kinos_requests"] != after["kinos_requests"]:
+        removed = collections.Counter(before["kinos_requests"]) - collections.Counter(after["kinos_requests"])
+        added = collections.Counter(after["kinos_requests"]) - collections.Counter(before["kinos_requests"])
+        print(f"\nRequêtes KinOS modifiées: {sum(removed.values())} retirée(s), {sum(added.values())} ajoutée(s)")
+        for request in list(added)[:5]:
+            print(f"    + {request[:200]}")
+
+    print(f"\n{'':<12}{'avant':>12}{'après':>12}")
+    for label, fraction in (("p50 (ms)", 0.5), ("p95 (ms)", 0.95)):
+        values = [percentile([entry["latency_ms"] for entry in run["updates"]], fraction) for run in (before, after)]
+        print(f"{label:<12}" + "".join(f"{str(value):>12}" for value in values))
+    print(f"\nRéponses différentes: {changed} sur {len(before['updates'])}")
+    return changed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rejouer hors ligne un trafic capturé")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Rejouer une capture contre le bot")
+    run_parser.add_argument("capture", help="Fichier de capture (.jsonl, .jsonl.gz ou .jsonl.zst)")
+    run_parser.add_argument("--speed", type=float, default=1.0, help="Facteur d'accélération (par défaut: 1)")
+    run_parser.add_argument("--max-gap", type=float, default=5.0,
+                            help="Attente maximale entre deux mises à jour, en secondes (par défaut: 5)")
+    run_parser.add_argument("--timeout", type=float, default=120, help="Attente maximale de la fin du traitement")
+    run_parser.add_argument("--out", help="Enregistrer le résultat dans ce fichier JSON (pour diff)")
+
+    diff_parser = subparsers.add_parser("diff", help="Comparer deux exécutions")
+    diff_parser.add_argument("before", help="Résultat de la première exécution")
+    diff_parser.add_argument("after", help="Résultat de la seconde exécution")
+
+    args = parser.parse_args()
+
+    if args.command == "run":
+        result = asyncio.run(run_replay(args.capture, args.speed, args.max_gap, args.timeout))
+        print_run(result)
+        if args.out:
+            with open(args.out, "w", encoding="utf-8") as out_file:
+                json.dump(result, out_file, ensure_ascii=False, indent=2)
+            print(f"Résultat enregistré dans {args.out}")
+        sys.exit(0 if result["completed"] else 1)
+    else:
+        with open(args.before, encoding="utf-8") as before_file, open(args.after, encoding="utf-8") as after_file:
+            changed = diff_runs(json.load(before_file), json.load(after_file))
+        sys.exit(1 if changed else 0)
@@ -0,0 +1,216 @@
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Limites de Telegram, en unités UTF-16 (un emoji en compte souvent deux)
+MAX_MESSAGE_LENGTH = 4096
+MAX_CAPTION_LENGTH = 1024
+
+# Un seul motif, compilé une fois, reconnaît tout ce que le Markdown « legacy »
+# de Telegram sait afficher, la syntaxe Markdown/HTML courante dans les
+# réponses des modèles, et les caractères spéciaux isolés à échapper.
+_ENTITY_PATTERN = re.compile(r"""
+    (?P<pre>```[\w+-]*\n?(?P<pre_body>[\s\S]*?)```)
+  | (?P<code>`(?P<code_body>[^`\n]+)`)
+  | (?P<link>\[(?P<link_text>[^\[\]\n]+)\]\((?P<link_url>https?://[^\s)]+)\))
+  | (?P<double>(?<![\w\\])(?P<double_mark>\*\*|__)(?=\S)(?P<double_body>[^\n]+?)(?<=\S)(?P=double_mark))
+  | (?P<bold>(?<![\w*\\])\*(?=[^\s*])(?P<bold_body>[^*\n]+?)(?<=[^\s*\\])\*(?![\w*]))
+  | (?P<italic>(?<![\w\\])_(?=[^\s_])(?P<italic_body>[^_\n]+?)(?<=[^\s_\\])_(?!\w))
+  | (?P<heading>^[ \t]*\#{1,6}[ \t]+(?P<heading_body>[^\n]+))
+  | (?P<bullet>^[ \t]*[*-][ \t]+)
+  | (?P<html><(?P<html_tag>b|strong|i|em|code|pre)>(?P<html_body>[^<]*)</(?P=html_tag)>)
+  | (?P<br><br\s*/?>)
+  | (?P<tag></?(?:b|strong|i|em|u|s|code|pre|p|span|div)\b[^>]*>)
+  | (?P<special>[_*`\[])
+""", re.VERBOSE | re.MULTILINE | re.IGNORECASE)
+
+_HTML_MARKS = {"b": "*", "strong": "*", "i": "_", "em": "_", "code": "`", "pre": "```"}
+_MARKUP_SPLIT = re.compile(r"([*_`\[])")
+
+# Points de coupure, du plus naturel au plus brutal
+_SEPARATORS = ("\n\n", "\n", ". ", "! ", "? ", " ")
+
+def telegram_length(text):
+    """Longueur d'un texte telle que Telegram la compte (unités UTF-16)."""
+    return len(text.encode("utf-16-le")) // 2
+
+def _wrap(body, opener, closer=None):
+    """
+    Entoure un texte d'une entité Markdown sans en perdre aucun caractère.
+
+    Telegram n'accepte pas d'échappement à l'intérieur d'une entité : autour
+    de chaque caractère spécial, l'entité est refermée puis rouverte, et le
+    caractère est échappé entre les deux (`*ce_truc*` devient
+    `*ce*\\_*truc*`).
+    """
+    closer = opener if closer is None else closer
+    wrapped = []
+    for piece in _MARKUP_SPLIT.split(body):
+        if _MARKUP_SPLIT.fullmatch(piece):
+            wrapped.append("\\" + piece)
+        elif piece.strip():
+            # Les espaces en bordure restent hors de l'entité
+            start, end = len(piece) - len(piece.lstrip()), len(piece.rstrip())
+            wrapped.append(f"{piece[:start]}{opener}{piece[start:end]}{closer}{piece[end:]}")
+        else:
+            wrapped.append(piece)
+    return "".join(wrapped)
+
+def sanitize_markdown(text):
+    """
+    Prépare un texte pour le Markdown de Telegram, en un seul passage.
+
+    Les entités bien formées sont conservées, la syntaxe Markdown/HTML que
+    Telegram ne comprend pas est convertie (`**gras**`, titres, listes,
+    balises `<b>`...) et les caractères spéciaux isolés sont échappés : le
+    résultat est toujours accepté par Telegram.
+
+    Args:
+        text (str): Le texte brut (typiquement une réponse de KinOS)
+
+    Returns:
+        tuple: (texte, parse_mode), parse_mode valant None si le texte ne contient aucune mise en forme
+    """
+    entities = 0
+
+    def replace(match):
+        nonlocal entities
+        kind = match.lastgroup
+        if kind == "special":
+            return "\\" + match.group()
+        if kind == "bullet":
+            return "• "
+        if kind == "br":
+            return "\n"
+        if kind == "tag":
+            return ""
+        entities += 1
+        if kind == "pre":
+            return f"```{match.group('pre_body')}```"
+        if kind == "code":
+            return match.group()
+        if kind == "link":
+            return _wrap(match.group("link_text"), "[", f"]({match.group('link_url')})")
+        if kind == "double":
+            return _wrap(match.group("double_body"), "*")
+        if kind == "bold":
+            return _wrap(match.group("bold_body"), "*")
+        if kind == "italic":
+            return _wrap(match.group("italic_body"), "_")
+        if kind == "heading":
+            return _wrap(match.group("heading_body").strip(), "*")
+        # kind == "html"
+        mark = _HTML_MARKS[match.group("html_tag").lower()]
+        body = match.group("html_body")
+        if not mark.startswith("`"):
+            return _wrap(body, mark)
+        if "`" in body:
+            # Un accent grave ne peut pas figurer dans du code : texte simple échappé
+            return _MARKUP_SPLIT.sub(r"\\\1", body)
+        return f"{mark}{body}{mark}"
+
+    sanitized = _ENTITY_PATTERN.sub(replace, text)
+    if not entities:
+        # Rien à mettre en forme : le texte part tel quel, sans parse_mode
+        return text, None
+    return sanitized, "Markdown"
+
+def split_message(text, limit=MAX_MESSAGE_LENGTH):
+    """
+    Découpe un texte trop long pour un seul message Telegram.
+
+    La coupure se fait de préférence entre deux paragraphes, puis entre deux
+    lignes, deux phrases ou deux mots, et jamais au milieu d'un bloc de code
+    quand c'est évitable.
+
+    Args:
+        text (str): Le texte à découper
+        limit (int, optional): La longueur maximale d'un morceau (unités UTF-16)
+
+    Returns:
+        list: Les morceaux, dans l'ordre
+    """
+    chunks = []
+    while telegram_length(text) > limit:
+        window = limit
+        while telegram_length(text[:window]) > limit:
+            window -= (telegram_length(text[:window]) - limit + 1) // 2 or 1
+
+        cut = None
+        for separator in _SEPARATORS:
+            position = text.rfind(separator, 0, window)
+            while position > window // 4 and text[:position].count("```") % 2:
+                position = text.rfind(separator, 0, position)
+            if position > window // 4:
+                cut = position + len(separator)
+                break
+        cut = cut or window
+
+        chunks.append(text[:cut].rstrip())
+        text = text[cut:].lstrip("\n")
+    if text.strip():
+        chunks.append(text)
+    return chunks
+
+def format_reply(text, limit=MAX_MESSAGE_LENGTH):
+    """
+    Prépare une réponse à envoyer : découpage puis mise en forme de chaque morceau.
+
+    Les échappements ajoutés par la mise en forme allongent le texte : un
+    morceau qui dépasse alors la limite est redécoupé plus finement. Le
+    résultat peut être réutilisé tel quel pour plusieurs destinataires.
+
+    Returns:
+        list: (texte brut, texte mis en forme, parse_mode) pour chaque message
+    """
+    parts = []
+    pending = split_message(text, limit)
+    while pending:
+        chunk = pending.pop(0)
+        formatted, parse_mode = sanitize_markdown(chunk)
+        formatted_length = telegram_length(formatted)
+        if formatted_length > limit and telegram_length(chunk) > 1:
+            # Limite réduite en proportion de l'allongement, pour ne pas redécouper en boucle
+            target = max(1, telegram_length(chunk) * limit // formatted_length - 1)
+            pending[:0] = split_message(chunk, target)
+            continue
+        parts.append((chunk, formatted, parse_mode))
+    return parts
+
+async def send_text(bot, chat_id, text=None, reply_to_message_id=None, parts=None):
+    """
+    Envoie un texte dans un ou plusieurs messages Telegram.
+
+    Chaque morceau part en un seul appel ; ce n'est que si Telegram refuse
+    malgré tout la mise en forme qu'il est renvoyé en texte brut.
+
+    Args:
+        bot (telegram.Bot): Le bot Telegram
+        chat_id (int|str): Le chat destinataire
+        text (str, optional): Le texte à envoyer
+        reply_to_message_id (int, optional): Le message auquel répond le premier morceau
+        parts (list, optional): Le résultat de format_reply(), s'il est déjà calculé
+
+    Returns:
+        list: Les messages envoyés
+    """
+    from telegram.error import BadRequest
+
+    messages = []
+    for raw, formatted, parse_mode in parts if parts is not None else format_reply(text):
+        try:
+            message = await bot.send_message(
+                chat_id=chat_id, text=formatted, parse_mode=parse_mode,
+                reply_to_message_id=reply_to_message_id
+            )
+        except BadRequest as e:
+            if parse_mode is None or "parse" not in str(e).lower():
+                raise
+            logger.warning(f"Mise en forme refusée par Telegram, envoi en texte brut: {e}")
+            message = await bot.send_message(
+                chat_id=chat_id, text=raw, reply_to_message_id=reply_to_message_id
+            )
+        messages.append(message)
+        reply_to_message_id = None
+    return messages
@@ -0,0 +1,229 @@
+"""
+Test de bout en bout du bot contre des serveurs locaux simulant Telegram et KinOS.
+
+Usage :
+    python scripts/selftest.py
+
+Une mise à jour Telegram est envoyée au webhook ; on mesure la latence de
+chaque étape jusqu'à la réponse renvoyée à Telegram. Aucune API réelle
+n'est appelée et aucune donnée locale (cache, comptabilité...) n'est modifiée.
+"""
+import os
+import sys
+import json
+import argparse
+import time
+import socket
+import asyncio
+import logging
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+STUB_TOKEN = "123456:selftest"
+STUB_REPLY = "Graou ! Je suis là 🦁 (réponse de test)"
+
+class StubState:
+    """Requêtes reçues par les serveurs simulés, horodatées."""
+
+    def __init__(self):
+        self.events = []
+        self.lock = threading.Lock()
+
+    def record(self, kind, data=None):
+        with self.lock:
+            self.events.append((time.monotonic(), kind, data))
+
+    def first(self, kind):
+        with self.lock:
+            for timestamp, event_kind, data in self.events:
+                if event_kind == kind:
+                    return timestamp, data
+        return None, None
+
+def make_stub_handler(state):
+    class StubHandler(BaseHTTPRequestHandler):
+        """Simule l'API Bot de Telegram (/bot<token>/<méthode>) et l'API KinOS (/v2/...)."""
+
+        def log_message(self, format, *args):
+            pass
+
+        def _reply(self, status, body):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_HEAD(self):
+            # Préchauffage et maintien des connexions vers KinOS
+            state.record("kinos_ping")
+            self.send_response(200)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def do_GET(self):
+            if self.path.startswith("/v2/"):
+                state.record("kinos_probe")
+                self._reply(200, [])
+            else:
+                self._reply(404, {"error": "not found"})
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            if self.path.startswith("/v2/"):
+                state.record("kinos_request", json.loads(body or b"{}"))
+                self._reply(200, {"response": STUB_REPLY, "status": "completed"})
+                state.record("kinos_response")
+                return
+
+            method = self.path.rsplit("/", 1)[-1]
+            state.record(f"telegram_{method}", body)
+            if method == "getMe":
+                result = {"id": 123456, "is_bot": True, "first_name": "Simba", "username": "simba_selftest_bot"}
+            elif method == "sendMessage":
+                result = {"message_id": 2, "date": int(time.time()),
+                          "chat": {"id": 1, "type": "private"}, "text": STUB_REPLY}
+            else:
+                result = True
+            self._reply(200, {"ok": True, "result": result})
+
+    return StubHandler
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def fake_update(text="Bonjour Simba !"):
+    now = int(time.time())
+    return {
+        "update_id": 1,
+        "message": {
+            "message_id": 1,
+            "date": now,
+            "chat": {"id": 1, "type": "private"},
+            "from": {"id": 1, "is_bot": False, "first_name": "Test"},
+            "text": text,
+        },
+    }
+
+async def wait_for(state, kind, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        timestamp, _ = state.first(kind)
+        if timestamp is not None:
+            return timestamp
+        await asyncio.sleep(0.005)
+    return None
+
+async def run_selftest():
+    """
+    Exécute le test et retourne les étapes mesurées.
+
+    Returns:
+        list: (étape, succès, durée en ms, détail)
+    """
+    stages = []
+    state = StubState()
+    stub_port = free_port()
+    stub = ThreadingHTTPServer(("127.0.0.1", stub_port), make_stub_handler(state))
+    threading.Thread(target=stub.serve_forever, daemon=True).start()
+
+    # Pointer le bot vers les serveurs simulés et isoler ses données locales
+    workdir = tempfile.mkdtemp(prefix="simba-selftest-")
+    os.environ.update({
+        "SIMBA_KINOS_API_BASE": f"http://127.0.0.1:{stub_port}/v2",
+        "KINOS_API_KEY": "selftest",
+        "TELEGRAM_BOT_TOKEN": STUB_TOKEN,
+        "TELEGRAM_CHAT_ID": "*",
+        "SIMBA_CACHE_DIR": os.path.join(workdir, "cache"),
+        "SIMBA_USAGE_DB": os.path.join(workdir, "usage.db"),
+        "SIMBA_PENDING_PATH": os.path.join(workdir, "pending.jsonl"),
+        "SIMBA_LATENCY_PATH": os.path.join(workdir, "latency.json"),
+        # Vide plutôt que retiré : load_dotenv ne la remet pas depuis .env
+        "SIMBA_CAPTURE_PATH": "",
+    })
+    os.environ.pop("SIMBA_IDEMPOTENCY_DB", None)
+    os.environ.pop("TELEGRAM_WEBHOOK_SECRET", None)
+
+    start = time.monotonic()
+    import httpx
+    import telegram_bot
+    from webhook_server import serve_webhook
+    logging.getLogger().setLevel(logging.WARNING)
+    stages.append(("Imports", True, (time.monotonic() - start) * 1000, ""))
+
+    application = telegram_bot.build_application(STUB_TOKEN, base_url=f"http://127.0.0.1:{stub_port}/bot")
+    port = free_port()
+    started, stopped = asyncio.Event(), asyncio.Event()
+
+    start = time.monotonic()
+    server = asyncio.create_task(serve_webhook(
+        application, telegram_bot.TRACKER,
+        webhook_url=None,
+        url_path="webhook",
+        port=port,
+        kinos_probe_url=f"{telegram_bot.kinos_client.KINOS_API_BASE}/blueprints/simba/kins",
+        kinos_api_key="selftest",
+        listen="127.0.0.1",
+        install_signals=False,
+        started=started,
+        stopped=stopped
+    ))
+    try:
+        await asyncio.wait_for(started.wait(), 10)
+        stages.append(("Démarrage (préchauffage inclus)", True, (time.monotonic() - start) * 1000, ""))
+        pinged, _ = state.first("kinos_ping")
+        stages.append(("Connexion KinOS préchauffée", pinged is not None, 0.0, "aucune requête de préchauffage"))
+
+        base = f"http://127.0.0.1:{port}"
+        async with httpx.AsyncClient(timeout=10) as client:
+            for path in ("/healthz", "/readyz", "/readyz"):
+                start = time.monotonic()
+                response = await client.get(base + path)
+                stages.append((f"GET {path}", response.status_code == 200,
+                               (time.monotonic() - start) * 1000, response.text))
+
+            start = time.monotonic()
+            response = await client.post(f"{base}/webhook", json=fake_update())
+            accepted = time.monotonic()
+            stages.append(("Réception webhook", response.status_code == 200, (accepted - start) * 1000, ""))
+
+        kinos_at = await wait_for(state, "kinos_request")
+        stages.append(("Traitement jusqu'à l'appel KinOS", kinos_at is not None,
+                       ((kinos_at or accepted) - accepted) * 1000, ""))
+        kinos_done = await wait_for(state, "kinos_response")
+        reply_at = await wait_for(state, "telegram_sendMessage")
+        stages.append(("Réponse KinOS jusqu'à l'envoi Telegram", reply_at is not None,
+                       ((reply_at or kinos_done or accepted) - (kinos_done or accepted)) * 1000, ""))
+        stages.append(("Total (webhook → réponse)", reply_at is not None,
+                       ((reply_at or accepted) - start) * 1000, ""))
+        probes = sum(1 for _, kind, _ in state.events if kind == "kinos_probe")
+        stages.append(("Sonde KinOS mise en cache", probes == 1, 0.0, f"{probes} appel(s) pour 2 /readyz"))
+    except asyncio.TimeoutError:
+        stages.append(("Démarrage (préchauffage inclus)", False, (time.monotonic() - start) * 1000, "délai dépassé"))
+    except Exception as e:
+        stages.append(("Exécution", False, (time.monotonic() - start) * 1000, str(e)))
+    finally:
+        stopped.set()
+        await server
+        stub.shutdown()
+
+    return stages
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tester le bot de bout en bout contre des serveurs simulés")
+    parser.parse_args()
+
+    stages = asyncio.run(run_selftest())
+
+    print(f"\n{'Étape':<42}{'Statut':<8}{'Durée':>10}")
+    print("-" * 60)
+    for name, ok, elapsed_ms, detail in stages:
+        print(f"{name:<42}{'OK' if ok else 'ÉCHEC':<8}{elapsed_ms:>8.1f}ms")
+        if detail and not ok:
+            print(f"    {detail}")
+
+    sys.exit(0 if all(ok for _, ok, _, _ in stages) else 1)
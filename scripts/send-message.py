@@ -3,15 +3,16 @@ import json
 import os
 import argparse
 import base64
-import telegram
-import asyncio
 from dotenv import load_dotenv
+import kinos_client
+from usage_accounting import BudgetExceededError
+from settings import get_settings
 
 # Charger les variables d'environnement
 load_dotenv()
 
 def send_message(blueprint_id, kin_id, content, images=None, attachments=None, 
-                model="claude-3-5-haiku-latest", history_length=25, 
+                model=None, history_length=None, 
                 add_system=None):
     """
     Envoie un message à un Kin spécifique.
@@ -22,18 +23,19 @@ def send_message(blueprint_id, kin_id, content, images=None, attachments=None,
         content (str): Le contenu du message
         images (list, optional): Liste des chemins d'images à envoyer
         attachments (list, optional): Liste des fichiers à joindre
-        model (str, optional): Le modèle à utiliser. Par défaut "claude-3-5-haiku-latest"
-        history_length (int, optional): Longueur de l'historique à considérer. Par défaut 25
+        model (str, optional): Le modèle à utiliser. Par défaut le réglage model
+        history_length (int, optional): Longueur de l'historique à considérer. Par défaut le réglage history_length
         add_system (str, optional): Instructions système supplémentaires
     
     Returns:
         dict: La réponse de l'API
     """
     # URL de l'API
-    api_url = f"https://api.kinos-engine.ai/v2/blueprints/{blueprint_id}/kins/{kin_id}/messages"
+    api_url = f"{kinos_client.KINOS_API_BASE}/blueprints/{blueprint_id}/kins/{kin_id}/messages"
     
-    # Récupérer la clé API depuis les variables d'environnement
-    api_key = os.getenv("KINOS_API_KEY")
+    # Récupérer la clé API depuis la configuration
+    settings = get_settings()
+    api_key = settings.kinos_api_key
     
     if not api_key:
         raise ValueError("La clé API KINOS_API_KEY n'est pas définie dans les variables d'environnement")
@@ -47,8 +49,8 @@ def send_message(blueprint_id, kin_id, content, images=None, attachments=None,
     # Préparer le corps de la requête
     payload = {
         "content": content,
-        "model": model,
-        "history_length": history_length
+        "model": model or settings.model,
+        "history_length": history_length if history_length is not None else settings.history_length
     }
     
     # Ajouter les instructions système si spécifiées
@@ -87,7 +89,7 @@ def send_message(blueprint_id, kin_id, content, images=None, attachments=None,
         print(f"Envoi de la requête à {api_url}")
         print(f"Payload: {json.dumps(payload, indent=2)}")
         
-        response = requests.post(api_url, headers=headers, json=payload)
+        response = kinos_client.post(api_url, headers, payload)
         
         print(f"Code de statut HTTP: {response.status_code}")
         print(f"Réponse brute: {response.text}")
@@ -98,6 +100,10 @@ def send_message(blueprint_id, kin_id, content, images=None, attachments=None,
         result = response.json()
         return result
     
+    except BudgetExceededError as e:
+        print(f"Requête refusée: {e}")
+        return None
+    
     except requests.exceptions.RequestException as e:
         print(f"Erreur lors de l'envoi du message: {e}")
         if hasattr(e, 'response') and e.response:
@@ -113,9 +119,13 @@ async def send_telegram_notification(message, chat_id, token):
         chat_id (str): L'ID du chat Telegram
         token (str): Le token du bot Telegram
     """
+    # Import différé : le module telegram est lourd et inutile avec --no-telegram
+    import telegram
+    from reply_format import send_text
+    
     try:
         bot = telegram.Bot(token=token)
-        await bot.send_message(chat_id=chat_id, text=message, parse_mode='Markdown')
+        await send_text(bot, chat_id, message)
         print("Notification Telegram envoyée avec succès")
     except Exception as e:
         print(f"Erreur lors de l'envoi de la notification Telegram: {e}")
@@ -126,15 +136,16 @@ if __name__ == "__main__":
     parser.add_argument("message", help="Le message à envoyer à Simba")
     parser.add_argument("--images", nargs="+", help="Chemins des images à envoyer")
     parser.add_argument("--attachments", nargs="+", help="Fichiers à joindre")
-    parser.add_argument("--model", default="claude-3-5-haiku-latest", help="Modèle à utiliser")
-    parser.add_argument("--history-length", type=int, default=25, help="Longueur de l'historique")
+    parser.add_argument("--model", help="Modèle à utiliser (par défaut le réglage model)")
+    parser.add_argument("--history-length", type=int, help="Longueur de l'historique (par défaut le réglage history_length)")
     parser.add_argument("--add-system", help="Instructions système supplémentaires")
     parser.add_argument("--no-telegram", action="store_true", help="Désactiver la notification Telegram")
     args = parser.parse_args()
     
     # Paramètres pour Simba
-    blueprint_id = "simba"
-    kin_id = "simba"
+    settings = get_settings()
+    blueprint_id = settings.blueprint_id
+    kin_id = settings.kin_id
     
     # Envoyer le message
     result = send_message(
@@ -168,9 +179,10 @@ if __name__ == "__main__":
         
         # Envoyer la notification Telegram si activée
         if not args.no_telegram:
-            # Récupérer les informations Telegram depuis les variables d'environnement
-            telegram_token = os.getenv("TELEGRAM_BOT_TOKEN")
-            telegram_chat_id = os.getenv("TELEGRAM_CHAT_ID")
+            # Récupérer les informations Telegram depuis la configuration
+            telegram_token = settings.telegram_bot_token
+            # Les notifications partent vers le premier chat autorisé
+            telegram_chat_id = next((c for c in settings.telegram_chat_id or [] if c != "*"), None)
             
             if telegram_token and telegram_chat_id:
                 # Préparer le message pour Telegram
@@ -181,6 +193,7 @@ if __name__ == "__main__":
                     telegram_message = "Simba n'a pas répondu. Il est peut-être en train de réfléchir..."
                 
                 # Envoyer la notification Telegram de manière asynchrone
+                import asyncio
                 asyncio.run(send_telegram_notification(telegram_message, telegram_chat_id, telegram_token))
             else:
                 print("Variables d'environnement TELEGRAM_BOT_TOKEN et/ou TELEGRAM_CHAT_ID non définies")
@@ -0,0 +1,348 @@
+"""
+Configuration de Simba, chargée et validée une seule fois.
+
+Chaque réglage a une valeur par défaut, que peuvent remplacer, par ordre de
+priorité croissante : le fichier JSON indiqué par SIMBA_SETTINGS_FILE (par
+défaut `~/.config/simba/settings.json` s'il existe), la variable
+d'environnement du réglage, puis `simba.py --set nom=valeur`.
+
+Les réglages marqués « à chaud » (modèles, délais, limites de concurrence,
+budgets...) sont relus sur SIGHUP sans redémarrer le bot ; les autres
+(clés, identifiants, ports) ne changent qu'au redémarrage.
+
+Usage :
+    python scripts/settings.py        # Afficher la configuration effective
+"""
+import os
+import json
+import signal
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS_FILE = os.path.join(os.path.expanduser("~"), ".config", "simba", "settings.json")
+
+CHILD_DRAWING_STYLE = (
+    ", 4 year old child drawing, crayon drawing, colorful scribbles, simple shapes, childish art style, "
+    "cute doodles, messy coloring, kindergarten art, construction paper, finger painting, naive art"
+)
+
+class SettingsError(ValueError):
+    """La configuration est invalide (le message liste tous les problèmes trouvés)."""
+
+class Setting:
+    """Déclaration d'un réglage : type, valeur par défaut, variable d'environnement et bornes."""
+
+    def __init__(self, name, type, default, env, reloadable=False, minimum=None, secret=False, help=""):
+        self.name = name
+        self.type = type
+        self.default = default
+        self.env = env
+        self.reloadable = reloadable
+        self.minimum = minimum
+        self.secret = secret
+        self.help = help
+
+    def parse(self, value):
+        """Convertit une valeur (texte de l'environnement ou valeur JSON) dans le type du réglage."""
+        if value is None or value == "":
+            return None
+        if self.type is bool:
+            if isinstance(value, bool):
+                return value
+            if str(value).lower() in ("1", "true", "yes", "oui", "on"):
+                return True
+            if str(value).lower() in ("0", "false", "no", "non", "off"):
+                return False
+            raise ValueError(f"booléen attendu, reçu {value!r}")
+        if self.type is list:
+            items = value if isinstance(value, list) else str(value).split(",")
+            return [str(item).strip() for item in items if str(item).strip()]
+        if self.type is int and isinstance(value, float) and not value.is_integer():
+            raise ValueError(f"entier attendu, reçu {value!r}")
+        parsed = self.type(value)
+        if self.minimum is not None and parsed < self.minimum:
+            raise ValueError(f"doit valoir au moins {self.minimum}, reçu {parsed}")
+        return parsed
+
+SETTINGS = [
+    # Clés et identifiants (redémarrage nécessaire)
+    Setting("kinos_api_key", str, None, "KINOS_API_KEY", secret=True, help="Clé API KinOS"),
+    Setting("kinos_api_base", str, "https://api.kinos-engine.ai/v2", "SIMBA_KINOS_API_BASE", help="URL de base de KinOS"),
+    Setting("telegram_bot_token", str, None, "TELEGRAM_BOT_TOKEN", secret=True, help="Token du bot Telegram"),
+    Setting("telegram_chat_id", list, [], "TELEGRAM_CHAT_ID",
+            help="Chats autorisés, séparés par des virgules (ou *) ; le premier reçoit les notifications"),
+    Setting("telegram_webhook_secret", str, None, "TELEGRAM_WEBHOOK_SECRET", secret=True, help="Secret du webhook"),
+    Setting("blueprint_id", str, "simba", "SIMBA_BLUEPRINT_ID", help="Blueprint KinOS"),
+    Setting("kin_id", str, "simba", "SIMBA_KIN_ID", help="Kin KinOS"),
+    Setting("port", int, 8080, "PORT", minimum=1, help="Port du serveur webhook"),
+
+    # Routage des modèles (à chaud)
+    Setting("model", str, "claude-3-5-haiku-latest", "SIMBA_MODEL", reloadable=True, help="Modèle des conversations"),
+    Setting("history_length", int, 25, "SIMBA_HISTORY_LENGTH", reloadable=True, minimum=0, help="Longueur de l'historique"),
+    Setting("mode", str, "creative", "SIMBA_MODE", reloadable=True, help="Mode des réponses du bot"),
+    Setting("cheap_model", str, "claude-3-haiku-20240307", "SIMBA_BUDGET_CHEAP_MODEL", reloadable=True,
+            help="Modèle utilisé quand le budget s'épuise"),
+    Setting("short_history_length", int, 5, "SIMBA_BUDGET_SHORT_HISTORY", reloadable=True, minimum=0,
+            help="Historique réduit quand le budget s'épuise"),
+    Setting("hedge_model", str, None, "SIMBA_HEDGE_MODEL", reloadable=True, help="Modèle des requêtes doublées"),
+    Setting("hedge_endpoints", list, ["analysis"], "SIMBA_HEDGE_ENDPOINTS", reloadable=True,
+            help="Endpoints où une requête peut être doublée"),
+    Setting("image_model", str, "V_2A", "SIMBA_IMAGE_MODEL", reloadable=True, help="Modèle de génération d'images"),
+    Setting("image_style_suffix", str, CHILD_DRAWING_STYLE, "SIMBA_IMAGE_STYLE", reloadable=True,
+            help="Mots-clés de style ajoutés aux demandes d'images"),
+
+    # Délais, en secondes (à chaud sauf le préchauffage)
+    Setting("kinos_timeout", float, 120.0, "SIMBA_KINOS_TIMEOUT", reloadable=True, minimum=1,
+            help="Délai maximal d'un appel KinOS"),
+    Setting("kinos_min_timeout", float, 15.0, "SIMBA_KINOS_MIN_TIMEOUT", reloadable=True, minimum=1,
+            help="Délai minimal d'un appel KinOS"),
+    Setting("drain_timeout", float, 20.0, "SIMBA_DRAIN_TIMEOUT", reloadable=True, minimum=0,
+            help="Durée maximale du drainage à l'arrêt"),
+    Setting("warmup", bool, True, "SIMBA_WARMUP", help="Préchauffer les connexions au démarrage"),
+    Setting("warmup_timeout", float, 10.0, "SIMBA_WARMUP_TIMEOUT", minimum=0, help="Durée maximale du préchauffage"),
+    Setting("keepalive_interval", float, 240.0, "SIMBA_KEEPALIVE_INTERVAL", reloadable=True, minimum=0,
+            help="Intervalle du maintien des connexions (0 = désactivé)"),
+    Setting("chat_action_interval", float, 4.0, "SIMBA_CHAT_ACTION_INTERVAL", reloadable=True, minimum=0.5,
+            help="Renouvellement de l'indicateur d'écriture"),
+    Setting("progress_after", float, 20.0, "SIMBA_PROGRESS_AFTER", reloadable=True, minimum=0,
+            help="Délai avant le message d'attente (0 = jamais)"),
+    Setting("ready_probe_ttl", float, 60.0, "SIMBA_READY_PROBE_TTL", reloadable=True, minimum=0,
+            help="Durée de cache de la sonde /readyz"),
+    Setting("health_max_queue", int, 100, "SIMBA_HEALTH_MAX_QUEUE", reloadable=True, minimum=1,
+            help="File d'attente maximale pour /healthz"),
+    Setting("health_max_loop_lag", float, 5.0, "SIMBA_HEALTH_MAX_LOOP_LAG", reloadable=True, minimum=0,
+            help="Retard maximal de la boucle pour /healthz"),
+
+    # Concurrence et limites (à chaud sauf la taille du pool et les fenêtres de mesure)
+    Setting("kinos_max_concurrency", int, 0, "SIMBA_KINOS_MAX_CONCURRENCY", reloadable=True, minimum=0,
+            help="Appels KinOS simultanés (0 = illimité)"),
+    Setting("kinos_pool_size", int, 16, "SIMBA_KINOS_POOL_SIZE", minimum=1, help="Connexions persistantes vers KinOS"),
+    Setting("broadcast_concurrency", int, 5, "SIMBA_BROADCAST_CONCURRENCY", reloadable=True, minimum=1,
+            help="Opérations simultanées de broadcast.py"),
+    Setting("broadcast_chat_interval", float, 1.0, "SIMBA_BROADCAST_CHAT_INTERVAL", reloadable=True, minimum=0,
+            help="Délai minimal entre deux envois à un même chat"),
+    Setting("media_max_bytes", int, 5 * 1024 * 1024, "SIMBA_MEDIA_MAX_BYTES", reloadable=True, minimum=1,
+            help="Taille maximale d'un média reçu (environ 4 fois plus en mémoire une fois encodé)"),
+    Setting("media_max_concurrency", int, 2, "SIMBA_MEDIA_MAX_CONCURRENCY", reloadable=True, minimum=1,
+            help="Médias téléchargés et encodés simultanément"),
+    Setting("media_spool_bytes", int, 1024 * 1024, "SIMBA_MEDIA_SPOOL_BYTES", reloadable=True, minimum=0,
+            help="Taille gardée en mémoire avant passage sur disque"),
+    Setting("cache_max_bytes", int, 200 * 1024 * 1024, "SIMBA_CACHE_MAX_BYTES", reloadable=True, minimum=1,
+            help="Taille maximale du cache média"),
+    Setting("idempotency_max_entries", int, 2048, "SIMBA_IDEMPOTENCY_MAX_ENTRIES", reloadable=True, minimum=1,
+            help="Clés de déduplication gardées en mémoire"),
+    Setting("latency_window", int, 200, "SIMBA_LATENCY_WINDOW", minimum=1, help="Mesures de latence conservées"),
+    Setting("usage_flush_interval", float, 60.0, "SIMBA_USAGE_FLUSH_INTERVAL", minimum=0,
+            help="Intervalle d'écriture de la comptabilité"),
+
+    # Budgets quotidiens (0 = illimité, à chaud)
+    Setting("budget_chat_calls", int, 0, "SIMBA_BUDGET_CHAT_CALLS", reloadable=True, minimum=0, help="Appels par chat"),
+    Setting("budget_chat_images", int, 0, "SIMBA_BUDGET_CHAT_IMAGES", reloadable=True, minimum=0, help="Images par chat"),
+    Setting("budget_chat_tokens", int, 0, "SIMBA_BUDGET_CHAT_TOKENS", reloadable=True, minimum=0, help="Tokens par chat"),
+    Setting("budget_kin_calls", int, 0, "SIMBA_BUDGET_KIN_CALLS", reloadable=True, minimum=0, help="Appels par kin"),
+    Setting("budget_kin_images", int, 0, "SIMBA_BUDGET_KIN_IMAGES", reloadable=True, minimum=0, help="Images par kin"),
+    Setting("budget_kin_tokens", int, 0, "SIMBA_BUDGET_KIN_TOKENS", reloadable=True, minimum=0, help="Tokens par kin"),
+]
+
+SETTINGS_BY_NAME = {setting.name: setting for setting in SETTINGS}
+
+class Settings:
+    """
+    Valeurs de configuration validées (instantané en lecture seule).
+
+    Un rechargement crée un nouvel instantané : un traitement qui garde une
+    référence à `get_settings()` voit des valeurs cohérentes jusqu'au bout.
+    """
+
+    def __init__(self, values, sources):
+        self.__dict__.update(values, _sources=sources)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Les réglages sont en lecture seule (modifier le fichier puis envoyer SIGHUP)")
+
+    def source(self, name):
+        """Origine d'une valeur : "défaut", "fichier", "env" ou "cli"."""
+        return self._sources[name]
+
+    def as_dict(self, mask_secrets=True):
+        return {
+            setting.name: ("***" if mask_secrets and setting.secret and getattr(self, setting.name)
+                           else getattr(self, setting.name))
+            for setting in SETTINGS
+        }
+
+_settings = None
+_overrides = {}
+_listeners = []
+_lock = threading.Lock()
+
+def _read_file(path):
+    try:
+        with open(path, "r", encoding="utf-8") as settings_file:
+            data = json.load(settings_file)
+    except FileNotFoundError:
+        if path != DEFAULT_SETTINGS_FILE:
+            raise SettingsError(f"Fichier de configuration introuvable: {path}")
+        return {}
+    except ValueError as e:
+        raise SettingsError(f"Fichier de configuration illisible ({path}): {e}")
+    if not isinstance(data, dict):
+        raise SettingsError(f"Le fichier de configuration doit contenir un objet JSON: {path}")
+    return data
+
+def build_settings(path=None, environ=None, overrides=None):
+    """
+    Lit et valide la configuration (défauts, fichier, environnement, ligne de commande).
+
+    Args:
+        path (str, optional): Le fichier JSON. Par défaut SIMBA_SETTINGS_FILE ou ~/.config/simba/settings.json
+        environ (dict, optional): Les variables d'environnement. Par défaut os.environ
+        overrides (dict, optional): Les valeurs passées en ligne de commande
+
+    Returns:
+        Settings: La configuration validée
+
+    Raises:
+        SettingsError: Si une valeur est invalide ou un réglage inconnu
+    """
+    environ = os.environ if environ is None else environ
+    overrides = _overrides if overrides is None else overrides
+    path = path or environ.get("SIMBA_SETTINGS_FILE") or DEFAULT_SETTINGS_FILE
+    file_values = _read_file(path)
+
+    errors = [f"réglage inconnu dans {path}: {name}" for name in file_values if name not in SETTINGS_BY_NAME]
+    errors += [f"réglage inconnu en ligne de commande: {name}" for name in overrides if name not in SETTINGS_BY_NAME]
+
+    values, sources = {}, {}
+    for setting in SETTINGS:
+        value, source = setting.default, "défaut"
+        for layer, candidate in (("fichier", file_values.get(setting.name)),
+                                 ("env", environ.get(setting.env)),
+                                 ("cli", overrides.get(setting.name))):
+            if candidate is None or candidate == "":
+                continue
+            try:
+                value, source = setting.parse(candidate), layer
+            except (TypeError, ValueError) as e:
+                errors.append(f"{setting.name} ({layer}): {e}")
+        values[setting.name], sources[setting.name] = value, source
+
+    if values["kinos_min_timeout"] > values["kinos_timeout"]:
+        errors.append("kinos_min_timeout ne peut pas dépasser kinos_timeout")
+    if errors:
+        raise SettingsError("Configuration invalide:\n  - " + "\n  - ".join(errors))
+    return Settings(values, sources)
+
+def load_settings(path=None):
+    """Charge (ou recharge entièrement) la configuration et la rend partagée."""
+    global _settings
+    settings = build_settings(path)
+    with _lock:
+        _settings = settings
+    return settings
+
+def get_settings():
+    """Retourne la configuration partagée, chargée et validée au premier appel."""
+    if _settings is None:
+        # Les scripts lisent .env avant leurs imports ; on le fait aussi pour un premier appel direct
+        try:
+            from dotenv import load_dotenv
+            load_dotenv()
+        except ImportError:
+            pass
+        return load_settings()
+    return _settings
+
+def set_overrides(overrides):
+    """
+    Enregistre les valeurs passées en ligne de commande (prioritaires sur tout le reste).
+
+    Args:
+        overrides (dict): Nom du réglage -> valeur (texte)
+    """
+    global _settings
+    _overrides.update(overrides)
+    _settings = None
+
+def on_reload(callback):
+    """Appelle `callback(settings)` après chaque rechargement réussi."""
+    _listeners.append(callback)
+
+def reload_settings():
+    """
+    Relit la configuration et applique les réglages modifiables à chaud.
+
+    Les autres changements sont signalés et ignorés jusqu'au redémarrage.
+    Une configuration invalide est refusée : l'ancienne reste en place.
+
+    Returns:
+        list: Les noms des réglages modifiés
+    """
+    global _settings
+    current = get_settings()
+    try:
+        fresh = build_settings()
+    except SettingsError as e:
+        logger.error(f"Rechargement refusé, configuration inchangée. {e}")
+        return []
+
+    values = current.as_dict(mask_secrets=False)
+    sources = dict(current._sources)
+    changed = []
+    for setting in SETTINGS:
+        new_value = getattr(fresh, setting.name)
+        if new_value == values[setting.name]:
+            continue
+        if setting.reloadable:
+            values[setting.name], sources[setting.name] = new_value, fresh.source(setting.name)
+            changed.append(setting.name)
+        else:
+            logger.warning(f"Réglage {setting.name} modifié: pris en compte au prochain redémarrage")
+
+    if changed:
+        with _lock:
+            _settings = Settings(values, sources)
+        logger.info(f"Configuration rechargée: {', '.join(changed)}")
+        for callback in _listeners:
+            try:
+                callback(_settings)
+            except Exception as e:
+                logger.error(f"Erreur lors de l'application de la configuration: {e}")
+    else:
+        logger.info("Configuration rechargée: aucun changement")
+    return changed
+
+def install_reload_handler():
+    """Recharge la configuration à chaud sur SIGHUP (sans effet sous Windows)."""
+    if not hasattr(signal, "SIGHUP"):
+        return
+    import asyncio
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, reload_settings)
+    except NotImplementedError:
+        pass
+
+if __name__ == "__main__":
+    import sys
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Afficher la configuration effective")
+    parser.parse_args()
+
+    # Passer par le module importé : c'est lui qui porte les valeurs de `simba.py --set`
+    from settings import SETTINGS, SettingsError, get_settings
+
+    try:
+        settings = get_settings()
+    except SettingsError as e:
+        print(e)
+        sys.exit(1)
+
+    print(f"{'Réglage':<26}{'Source':<10}{'À chaud':<9}Valeur")
+    print("-" * 80)
+    for setting in SETTINGS:
+        value = settings.as_dict()[setting.name]
+        print(f"{setting.name:<26}{settings.source(setting.name):<10}{'oui' if setting.reloadable else 'non':<9}"
+              f"{str(value)[:60]}")
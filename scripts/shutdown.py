@@ -0,0 +1,208 @@
+import os
+import json
+import time
+import signal
+import asyncio
+import logging
+import functools
+from settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Emplacement par défaut du fichier de reprise (modifiable via l'environnement). Il doit
+# être lisible par l'instance suivante : même machine, ou disque persistant partagé
+DEFAULT_PENDING_PATH = os.path.join(os.path.expanduser("~"), ".local", "share", "simba", "pending.jsonl")
+
+# Envoyé à la reprise quand le message était parti vers KinOS mais que la réponse a été perdue
+INTERRUPTED_TEXT = "Oups, j'ai été interrompu avant de pouvoir te répondre... 🙈"
+
+class InflightTracker:
+    """
+    Suivi des mises à jour en cours de traitement.
+
+    À l'arrêt, le tracker cesse d'accepter de nouvelles mises à jour, attend
+    la fin de celles en cours jusqu'à une échéance, puis enregistre celles
+    qui restent (avec la réponse de KinOS si elle a déjà été obtenue, ou le
+    fait que le message lui a déjà été envoyé) pour que l'instance suivante
+    les reprenne.
+    """
+
+    def __init__(self, pending_path=None):
+        self.pending_path = pending_path or os.getenv("SIMBA_PENDING_PATH", DEFAULT_PENDING_PATH)
+        self.accepting = True
+        self._inflight = {}   # update_id -> {"update": dict, "response": str, "sent": bool, "task": Task}
+
+    def __len__(self):
+        return len(self._inflight)
+
+    def tracked(self, handler):
+        """
+        Décore un gestionnaire Telegram pour suivre son exécution.
+
+        Une fois l'arrêt commencé, les nouvelles mises à jour ne sont plus
+        traitées mais mises de côté pour l'instance suivante.
+        """
+        @functools.wraps(handler)
+        async def wrapper(update, context):
+            if not self.accepting:
+                logger.info(f"Arrêt en cours, mise à jour mise de côté: {update.update_id}")
+                self.save([{"update": update.to_dict(), "response": None, "sent": False}])
+                return
+            self._inflight[update.update_id] = {
+                "update": update.to_dict(),
+                "response": None,
+                "sent": False,
+                "task": asyncio.current_task(),
+            }
+            try:
+                await handler(update, context)
+            finally:
+                self._inflight.pop(update.update_id, None)
+        return wrapper
+
+    def mark_sent(self, update):
+        """Note que le message d'une mise à jour est parti vers KinOS : il ne doit pas être renvoyé à la reprise."""
+        entry = self._inflight.get(update.update_id)
+        if entry is not None:
+            entry["sent"] = True
+
+    def set_response(self, update, response):
+        """Note la réponse de KinOS d'une mise à jour, pour ne pas la redemander à la reprise."""
+        entry = self._inflight.get(update.update_id)
+        if entry is not None:
+            entry["response"] = response
+
+    async def drain(self, timeout=None):
+        """
+        Cesse d'accepter de nouvelles mises à jour et attend la fin de celles en cours.
+
+        Les mises à jour encore en cours à l'échéance sont enregistrées puis annulées.
+
+        Returns:
+            int: Le nombre de mises à jour enregistrées pour reprise
+        """
+        self.accepting = False
+        if timeout is None:
+            # Render tue le processus 30 s après SIGTERM
+            timeout = get_settings().drain_timeout
+        logger.info(f"Arrêt: attente de {len(self._inflight)} mise(s) à jour en cours (max {timeout} s)")
+        deadline = time.monotonic() + timeout
+        while self._inflight and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        if self._inflight:
+            logger.warning(f"Échéance atteinte avec {len(self._inflight)} mise(s) à jour en cours")
+
+        unfinished = [
+            {"update": entry["update"], "response": entry["response"], "sent": entry["sent"]}
+            for entry in self._inflight.values()
+        ]
+        if unfinished:
+            self.save(unfinished)
+
+        for entry in list(self._inflight.values()):
+            entry["task"].cancel()
+        return len(unfinished)
+
+    def save(self, entries):
+        """Ajoute des mises à jour non traitées au fichier de reprise."""
+        directory = os.path.dirname(self.pending_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.pending_path, "a", encoding="utf-8") as pending_file:
+            for entry in entries:
+                pending_file.write(json.dumps(dict(entry, saved_at=time.time()), ensure_ascii=False) + "\n")
+        logger.info(f"{len(entries)} mise(s) à jour enregistrée(s) pour reprise dans {self.pending_path}")
+
+    def load(self):
+        """
+        Lit et vide le fichier de reprise.
+
+        Returns:
+            list: Les entrées enregistrées par l'instance précédente
+        """
+        try:
+            with open(self.pending_path, "r", encoding="utf-8") as pending_file:
+                lines = pending_file.readlines()
+        except FileNotFoundError:
+            return []
+        os.remove(self.pending_path)
+
+        entries = []
+        for line in lines:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                logger.warning(f"Entrée de reprise illisible ignorée: {line[:100]}")
+        return entries
+
+async def resume_pending(application, tracker):
+    """
+    Reprend les mises à jour laissées par l'instance précédente.
+
+    Si la réponse de KinOS avait déjà été obtenue, elle est envoyée
+    directement. Si le message était déjà parti vers KinOS sans réponse,
+    il n'est pas renvoyé (il figurerait deux fois dans l'historique du Kin) :
+    l'utilisateur est seulement prévenu. Sinon la mise à jour est remise dans
+    la file du bot.
+    """
+    from telegram import Update
+    from reply_format import send_text
+
+    for entry in tracker.load():
+        update = Update.de_json(entry["update"], application.bot)
+        if entry.get("response") or entry.get("sent"):
+            if entry.get("response"):
+                logger.info(f"Reprise: envoi de la réponse déjà obtenue pour {update.update_id}")
+                text = entry["response"]
+            else:
+                logger.info(f"Reprise: {update.update_id} déjà envoyée à KinOS, pas de renvoi")
+                text = INTERRUPTED_TEXT
+            try:
+                await send_text(
+                    application.bot,
+                    update.effective_chat.id,
+                    text,
+                    reply_to_message_id=update.effective_message.message_id
+                )
+            except Exception as e:
+                logger.error(f"Erreur lors de la reprise de {update.update_id}: {e}")
+        else:
+            logger.info(f"Reprise: retraitement de la mise à jour {update.update_id}")
+            await application.update_queue.put(update)
+
+def install_signal_handlers(tracker, stop_accepting, on_drained, timeout=None):
+    """
+    Installe l'arrêt progressif sur SIGTERM et SIGINT.
+
+    Au premier signal, la réception des mises à jour est arrêtée, celles en
+    cours sont drainées puis `on_drained` est appelé. Un second signal
+    appelle `on_drained` immédiatement.
+
+    Args:
+        tracker (InflightTracker): Le suivi des mises à jour en cours
+        stop_accepting (callable): Coroutine arrêtant la réception (serveur webhook, polling)
+        on_drained (callable): Fonction terminant l'application
+        timeout (float, optional): Durée maximale du drainage, en secondes. Par défaut le réglage drain_timeout
+    """
+    loop = asyncio.get_running_loop()
+    state = {"task": None}
+
+    async def graceful_stop():
+        await stop_accepting()
+        await tracker.drain(timeout)
+        on_drained()
+
+    def on_signal(signum):
+        if state["task"] is None:
+            logger.info(f"Signal {signal.Signals(signum).name} reçu: arrêt progressif")
+            state["task"] = loop.create_task(graceful_stop())
+        else:
+            logger.warning("Second signal reçu: arrêt immédiat")
+            on_drained()
+
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(signum, on_signal, signum)
+        except NotImplementedError:
+            # Windows : pas de gestionnaire de signaux dans la boucle asyncio
+            pass
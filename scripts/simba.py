@@ -0,0 +1,147 @@
+"""
+Point d'entrée unique pour les scripts de Simba.
+
+Usage :
+    python scripts/simba.py [--timings] [--set nom=valeur]... <commande> [arguments...]
+
+Les modules lourds (requests, telegram...) ne sont importés que par la
+commande qui en a besoin : ce fichier n'importe que la bibliothèque standard.
+"""
+import time
+
+_START = time.perf_counter()
+
+import os
+import sys
+import runpy
+import builtins
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Commande -> (script exécuté, description)
+COMMANDS = {
+    "send": ("send-message.py", "Envoyer un message à Simba"),
+    "analyze": ("analyze.py", "Analyser l'état émotionnel de Simba"),
+    "draw": ("generate_image.py", "Générer une image avec Simba"),
+    "think": ("autonomous-thinking.py", "Déclencher la pensée autonome"),
+    "broadcast": ("broadcast.py", "Envoyer des messages d'initiative à plusieurs chats et Kins"),
+    "create": ("create_kin.py", "Créer le Kin Simba"),
+    "usage": ("usage_accounting.py", "Afficher la consommation KinOS du jour"),
+    "bot": ("telegram_bot.py", "Démarrer le bot Telegram"),
+    "selftest": ("selftest.py", "Tester le bot de bout en bout contre des serveurs simulés"),
+    "replay": ("replay.py", "Rejouer hors ligne un trafic capturé et comparer deux exécutions"),
+    "config": ("settings.py", "Afficher la configuration effective"),
+}
+
+class ImportTimer:
+    """
+    Mesure le temps d'import des modules de premier niveau, à la manière de
+    `python -X importtime`, sans avoir à relancer l'interpréteur.
+    """
+
+    def __init__(self):
+        self.timings = {}
+        self._depth = 0
+        self._original_import = builtins.__import__
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        # Un import relatif (level > 0) vient d'un paquet déjà en cours d'import
+        top_level = name.partition(".")[0]
+        if self._depth or level or not top_level or top_level in sys.modules:
+            return self._original_import(name, globals, locals, fromlist, level)
+
+        self._depth += 1
+        start = time.perf_counter()
+        try:
+            return self._original_import(name, globals, locals, fromlist, level)
+        finally:
+            self._depth -= 1
+            self.timings[top_level] = self.timings.get(top_level, 0) + time.perf_counter() - start
+
+    def install(self):
+        builtins.__import__ = self._import
+
+    def uninstall(self):
+        builtins.__import__ = self._original_import
+
+    def report(self, total, file=sys.stderr):
+        """Affiche les imports les plus coûteux et le temps total d'exécution."""
+        print("\nTemps d'import (modules de premier niveau):", file=file)
+        for name, elapsed in sorted(self.timings.items(), key=lambda item: item[1], reverse=True):
+            print(f"  {elapsed * 1000:8.1f} ms  {name}", file=file)
+        print(f"  {sum(self.timings.values()) * 1000:8.1f} ms  total des imports", file=file)
+        print(f"Temps total: {total * 1000:.1f} ms", file=file)
+
+def print_usage(file=sys.stdout):
+    print("Usage: simba.py [--timings] [--set nom=valeur]... <commande> [arguments...]\n", file=file)
+    print("Commandes:", file=file)
+    for command, (script, description) in COMMANDS.items():
+        print(f"  {command:<10} {description} ({script})", file=file)
+    print("\nOptions:", file=file)
+    print("  --timings         Afficher les temps d'import et d'exécution", file=file)
+    print("  --set nom=valeur  Remplacer un réglage pour cette exécution (voir `simba.py config`)", file=file)
+    print("\nUtilisez `simba.py <commande> --help` pour les options de chaque commande.", file=file)
+
+def main(argv=None):
+    """
+    Exécute la commande demandée.
+
+    Le script correspondant est exécuté comme s'il avait été lancé
+    directement : ses arguments lui sont transmis tels quels.
+
+    Returns:
+        int: Le code de sortie
+    """
+    argv = list(sys.argv[1:] if argv is None else argv)
+
+    timings = False
+    overrides = {}
+    while argv and argv[0] in ("--timings", "--set"):
+        option = argv.pop(0)
+        if option == "--timings":
+            timings = True
+            continue
+        name, separator, value = (argv.pop(0) if argv else "").partition("=")
+        if not separator or not name:
+            print("--set attend un argument de la forme nom=valeur\n", file=sys.stderr)
+            print_usage(file=sys.stderr)
+            return 2
+        overrides[name.strip()] = value
+
+    if not argv or argv[0] in ("-h", "--help"):
+        print_usage()
+        return 0
+
+    command, args = argv[0], argv[1:]
+    if command not in COMMANDS:
+        print(f"Commande inconnue: {command}\n", file=sys.stderr)
+        print_usage(file=sys.stderr)
+        return 2
+
+    timer = ImportTimer()
+    if timings:
+        timer.install()
+
+    script = os.path.join(SCRIPTS_DIR, COMMANDS[command][0])
+    sys.argv = [script] + args
+    if SCRIPTS_DIR not in sys.path:
+        sys.path.insert(0, SCRIPTS_DIR)
+    if overrides:
+        # La configuration est validée au premier get_settings() du script
+        import settings
+        settings.set_overrides(overrides)
+
+    exit_code = 0
+    try:
+        runpy.run_path(script, run_name="__main__")
+    except SystemExit as e:
+        exit_code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    finally:
+        if timings:
+            timer.uninstall()
+            timer.report(time.perf_counter() - _START)
+
+    return exit_code
+
+if __name__ == "__main__":
+    sys.exit(main())
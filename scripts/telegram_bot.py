@@ -1,12 +1,22 @@
 import os
 import logging
 import asyncio
+import argparse
 from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
+from telegram.ext import Application, CommandHandler, MessageHandler, TypeHandler, filters, ContextTypes
 from dotenv import load_dotenv
-import requests
+import kinos_client
+from usage_accounting import BudgetExceededError
+from shutdown import InflightTracker, install_signal_handlers, resume_pending
+from warmup import KeepAlive, warm_up
+from settings import get_settings, on_reload, install_reload_handler
 import json
 import sys
+from media_ingest import fetch_data_url, is_attachment_type, is_image_type, MediaTooLargeError, close_http_client
+from idempotency import IdempotencyStore, update_key, payload_key, DEFAULT_UPDATE_TTL
+from reply_format import send_text
+from chat_action import ChatActionKeeper
+from traffic_capture import get_recorder
 
 # Configuration du logging
 logging.basicConfig(
@@ -18,60 +28,145 @@ logger = logging.getLogger(__name__)
 # Charger les variables d'environnement
 load_dotenv()
 
-# Récupérer les tokens et IDs
-TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
-KINOS_API_KEY = os.getenv("KINOS_API_KEY")
+# Récupérer les tokens et IDs (configuration validée au démarrage, voir settings.py)
+SETTINGS = get_settings()
+TELEGRAM_BOT_TOKEN = SETTINGS.telegram_bot_token
+# Plusieurs chats peuvent être autorisés (IDs séparés par des virgules), ou tous avec "*"
+AUTHORIZED_CHAT_IDS = set(SETTINGS.telegram_chat_id or [])
+TELEGRAM_WEBHOOK_SECRET = SETTINGS.telegram_webhook_secret
+KINOS_API_KEY = SETTINGS.kinos_api_key
 
 # Configuration de Simba
-BLUEPRINT_ID = "simba"
-KIN_ID = "simba"
+BLUEPRINT_ID = SETTINGS.blueprint_id
+KIN_ID = SETTINGS.kin_id
+
+# Requête KinOS préparée une fois pour toutes : seul le contenu change d'un message à l'autre
+KINOS_MESSAGES_URL = f"{kinos_client.KINOS_API_BASE}/blueprints/{BLUEPRINT_ID}/kins/{KIN_ID}/messages"
+KINOS_HEADERS = {
+    "Authorization": f"Bearer {KINOS_API_KEY}",
+    "Content-Type": "application/json"
+}
+
+def build_payload_template(settings):
+    """Prépare le corps des requêtes KinOS (reconstruit quand le routage des modèles est rechargé)."""
+    global KINOS_PAYLOAD_TEMPLATE
+    KINOS_PAYLOAD_TEMPLATE = {
+        "model": settings.model,
+        "history_length": settings.history_length,
+        "mode": settings.mode
+    }
+
+build_payload_template(SETTINGS)
+on_reload(build_payload_template)
+
+# Message envoyé quand la réponse de KinOS tarde, pour éviter que l'utilisateur ne renvoie le sien
+PROGRESS_TEXT = "Simba réfléchit encore... 🦁"
+
+# Réponses envoyées à la place de celle de Simba quand KinOS n'a pas pu répondre
+BUDGET_EXCEEDED_TEXT = "Simba a beaucoup parlé aujourd'hui, il est tout fatigué... 😴 On se reparle demain !"
+KINOS_ERROR_TEXT = "Désolé, je n'ai pas pu communiquer avec Simba pour le moment."
+
+# Déduplication des messages envoyés à KinOS (mises à jour renvoyées, double envoi)
+DEDUP = IdempotencyStore()
+
+# Suivi des mises à jour en cours, pour les drainer lors d'un redéploiement
+TRACKER = InflightTracker()
+
+# Les mises à jour sont traitées en parallèle (concurrent_updates), mais les messages
+# d'un même chat partent vers KinOS un par un : chacun voit la réponse au précédent
+# dans son historique et les réponses arrivent dans l'ordre
+CHAT_LOCKS = {}
+
+def chat_lock(chat_id):
+    """Retourne le verrou qui sérialise les échanges avec KinOS d'un chat."""
+    lock = CHAT_LOCKS.get(chat_id)
+    if lock is None:
+        lock = CHAT_LOCKS[chat_id] = asyncio.Lock()
+    return lock
 
 # Configuration pour Render
-PORT = int(os.environ.get('PORT', 8080))
+PORT = SETTINGS.port
 
-async def send_to_kinos(content, images=None):
+async def send_to_kinos(content, images=None, attachments=None, chat_id=None):
     """
     Envoie un message à KinOS et retourne la réponse.
     
     Args:
         content (str): Le contenu du message
         images (list, optional): Liste des images encodées en base64
+        attachments (list, optional): Liste des pièces jointes encodées en base64
+        chat_id (int, optional): Le chat à l'origine du message, pour la comptabilité
     
     Returns:
         str: La réponse de KinOS
-    """
-    api_url = f"https://api.kinos-engine.ai/v2/blueprints/{BLUEPRINT_ID}/kins/{KIN_ID}/messages"
     
-    headers = {
-        "Authorization": f"Bearer {KINOS_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    
-    payload = {
-        "content": content,
-        "model": "claude-3-5-haiku-latest",
-        "history_length": 25,
-        "mode": "creative"
-    }
+    Raises:
+        BudgetExceededError: Si le budget du chat est épuisé
+        Exception: Si KinOS n'a pas pu être joint ou a répondu en erreur
+    """
+    payload = dict(KINOS_PAYLOAD_TEMPLATE, content=content)
     
     if images:
         payload["images"] = images
     
-    try:
-        logger.info(f"Envoi du message à KinOS: {content}")
-        response = requests.post(api_url, headers=headers, json=payload)
-        response.raise_for_status()
-        
-        result = response.json()
-        logger.info(f"Réponse reçue de KinOS: {result}")
-        
-        # Extraire la réponse (peut être dans 'response' ou 'content')
-        return result.get("response") or result.get("content")
+    if attachments:
+        payload["attachments"] = attachments
+    
+    logger.info(f"Envoi du message à KinOS: {content}")
+    # Requête bloquante exécutée dans un thread pour ne pas figer la boucle d'événements
+    response = await asyncio.to_thread(kinos_client.post, KINOS_MESSAGES_URL, KINOS_HEADERS, payload, chat_id)
+    response.raise_for_status()
+    
+    result = response.json()
+    logger.info(f"Réponse reçue de KinOS: {result}")
+    
+    # Extraire la réponse (peut être dans 'response' ou 'content')
+    return result.get("response") or result.get("content")
+
+async def send_to_kinos_once(update, content, images=None, attachments=None):
+    """
+    Envoie un message à KinOS une seule fois par mise à jour et par contenu.
+    
+    Une mise à jour déjà traitée (renvoyée par Telegram) est ignorée, et un
+    même contenu envoyé plusieurs fois dans une courte fenêtre (double appui)
+    ne part qu'une fois vers KinOS : les requêtes identiques en cours
+    partagent la même réponse. Les échecs sont convertis en message
+    d'excuse ici, hors de la déduplication : ils ne sont pas mémorisés et
+    un renvoi du même contenu repart bien vers KinOS.
+    
+    Args:
+        update (Update): La mise à jour Telegram
+        content (str): Le contenu du message
+        images (list, optional): Liste des images encodées en base64
+        attachments (list, optional): Liste des pièces jointes encodées en base64
     
+    Returns:
+        str: La réponse de KinOS, ou None si le message est un doublon
+    """
+    update_id = update_key(update)
+    if DEDUP.seen(update_id):
+        logger.info(f"Mise à jour déjà traitée, ignorée: {update_id}")
+        return None
+    
+    async def send():
+        # À partir d'ici, une reprise après arrêt ne doit plus renvoyer ce message à KinOS
+        TRACKER.mark_sent(update)
+        return await send_to_kinos(content, images=images, attachments=attachments, chat_id=update.effective_chat.id)
+    
+    try:
+        response, duplicate = await DEDUP.run(
+            payload_key(update.effective_chat.id, content, (images or []) + (attachments or [])),
+            send
+        )
+    except BudgetExceededError as e:
+        logger.warning(str(e))
+        response, duplicate = BUDGET_EXCEEDED_TEXT, False
     except Exception as e:
         logger.error(f"Erreur lors de l'envoi du message à KinOS: {e}")
-        return "Désolé, je n'ai pas pu communiquer avec Simba pour le moment."
+        response, duplicate = KINOS_ERROR_TEXT, False
+    DEDUP.mark(update_id, DEFAULT_UPDATE_TTL)
+    
+    return None if duplicate else response
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Gestionnaire pour la commande /start."""
@@ -82,68 +177,237 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Gestionnaire pour la commande /help."""
     await update.message.reply_text(
-        "Vous pouvez m'envoyer des messages texte ou des images, et je vous répondrai en tant que Simba !"
+        "Vous pouvez m'envoyer des messages texte, des images, des messages vocaux, des documents "
+        "ou des autocollants, et je vous répondrai en tant que Simba !"
     )
 
+def is_authorized(update):
+    """Vérifie si le message provient d'un chat autorisé."""
+    if str(update.effective_chat.id) not in AUTHORIZED_CHAT_IDS and "*" not in AUTHORIZED_CHAT_IDS:
+        logger.warning(f"Message reçu d'un chat non autorisé: {update.effective_chat.id}")
+        return False
+    return True
+
+async def reply_from_kinos(update, context, content, images=None, attachments=None):
+    """
+    Envoie un message (et ses médias) à KinOS puis répond avec la réponse de Simba.
+    
+    Les messages d'un même chat sont traités l'un après l'autre ; des chats
+    différents restent servis en parallèle.
+    
+    Args:
+        update (Update): La mise à jour Telegram
+        context (ContextTypes.DEFAULT_TYPE): Le contexte du gestionnaire
+        content (str): Le contenu du message
+        images (list, optional): Liste des images encodées en base64
+        attachments (list, optional): Liste des pièces jointes encodées en base64
+    """
+    async with chat_lock(update.effective_chat.id):
+        # Indiquer que le bot est en train d'écrire, jusqu'à la réponse de KinOS
+        async with ChatActionKeeper(context.bot, update.effective_chat.id, "typing",
+                                    progress_text=PROGRESS_TEXT,
+                                    reply_to_message_id=update.message.message_id):
+            response = await send_to_kinos_once(update, content, images=images, attachments=attachments)
+        if response is None:
+            return
+        TRACKER.set_response(update, response)
+        
+        # Envoyer la réponse (mise en forme et découpée si elle dépasse la limite de Telegram)
+        await send_text(context.bot, update.effective_chat.id, response,
+                        reply_to_message_id=update.message.message_id)
+
+async def fetch_media(update, context, media, mime_type):
+    """
+    Télécharge un média en flux et le convertit en URL data.
+    
+    Returns:
+        str: L'URL data du média, ou None s'il est trop volumineux (l'utilisateur est prévenu)
+    """
+    try:
+        async with ChatActionKeeper(context.bot, update.effective_chat.id, "typing"):
+            return await fetch_data_url(context.bot, media, mime_type)
+    except MediaTooLargeError as e:
+        logger.warning(f"Média ignoré: {e}")
+        await update.message.reply_text("Oh là là, ce fichier est trop gros pour moi ! 🙈")
+        return None
+
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Gestionnaire pour les messages texte."""
-    # Vérifier si le message provient du chat autorisé
-    if str(update.effective_chat.id) != TELEGRAM_CHAT_ID and TELEGRAM_CHAT_ID != "*":
-        logger.warning(f"Message reçu d'un chat non autorisé: {update.effective_chat.id}")
+    if not is_authorized(update):
         return
     
     # Récupérer le message
     message_text = update.message.text
     logger.info(f"Message reçu: {message_text}")
     
-    # Indiquer que le bot est en train d'écrire
-    await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
-    
-    # Envoyer le message à KinOS et obtenir la réponse
-    response = await send_to_kinos(message_text)
-    
-    # Envoyer la réponse
-    await update.message.reply_text(response)
+    await reply_from_kinos(update, context, message_text)
 
 async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Gestionnaire pour les messages avec photos."""
-    # Vérifier si le message provient du chat autorisé
-    if str(update.effective_chat.id) != TELEGRAM_CHAT_ID and TELEGRAM_CHAT_ID != "*":
+    if not is_authorized(update):
         return
     
     # Récupérer la photo (la plus grande résolution disponible)
-    photo_file = await context.bot.get_file(update.message.photo[-1].file_id)
+    photo_data_url = await fetch_media(update, context, update.message.photo[-1], "image/jpeg")
+    if photo_data_url is None:
+        return
+    
+    # Récupérer la légende de la photo ou utiliser un texte par défaut
+    caption = update.message.caption or "Regarde cette image !"
     
-    # Télécharger la photo
-    photo_bytes = await photo_file.download_as_bytearray()
+    await reply_from_kinos(update, context, caption, images=[photo_data_url])
+
+async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Gestionnaire pour les messages vocaux et fichiers audio."""
+    if not is_authorized(update):
+        return
     
-    # Convertir en base64
-    import base64
-    photo_base64 = base64.b64encode(photo_bytes).decode('utf-8')
+    audio = update.message.voice or update.message.audio
+    logger.info(f"Message vocal reçu ({audio.duration} s)")
     
-    # Créer l'URL data
-    photo_data_url = f"data:image/jpeg;base64,{photo_base64}"
+    # Le fichier audio est transmis à KinOS comme pièce jointe
+    audio_data_url = await fetch_media(update, context, audio, audio.mime_type or "audio/ogg")
+    if audio_data_url is None:
+        return
     
-    # Récupérer la légende de la photo ou utiliser un texte par défaut
-    caption = update.message.caption or "Regarde cette image !"
+    caption = update.message.caption or "Écoute mon message vocal !"
+    
+    await reply_from_kinos(update, context, caption, attachments=[audio_data_url])
+
+async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Gestionnaire pour les documents (PDF, textes, images envoyées en fichier)."""
+    if not is_authorized(update):
+        return
+    
+    document = update.message.document
+    mime_type = document.mime_type
+    logger.info(f"Document reçu: {document.file_name} ({mime_type})")
+    
+    if not (is_image_type(mime_type) or is_attachment_type(mime_type)):
+        await update.message.reply_text("Je ne sais pas encore lire ce genre de fichier... 🤔")
+        return
+    
+    document_data_url = await fetch_media(update, context, document, mime_type)
+    if document_data_url is None:
+        return
+    
+    caption = update.message.caption or f"Regarde ce fichier : {document.file_name or 'document'}"
+    
+    # Les images envoyées en fichier suivent le même chemin que les photos
+    if is_image_type(mime_type):
+        await reply_from_kinos(update, context, caption, images=[document_data_url])
+    else:
+        await reply_from_kinos(update, context, caption, attachments=[document_data_url])
+
+async def handle_sticker(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Gestionnaire pour les autocollants."""
+    if not is_authorized(update):
+        return
+    
+    sticker = update.message.sticker
+    
+    # Les autocollants animés (TGS) ou vidéo (WEBM) sont remplacés par leur miniature
+    if sticker.is_animated or sticker.is_video:
+        media, mime_type = sticker.thumbnail, "image/webp"
+    else:
+        media, mime_type = sticker, "image/webp"
+    
+    content = f"{sticker.emoji or ''} (autocollant)".strip()
+    if media is None:
+        await reply_from_kinos(update, context, content)
+        return
+    
+    sticker_data_url = await fetch_media(update, context, media, mime_type)
+    if sticker_data_url is None:
+        return
+    
+    await reply_from_kinos(update, context, content, images=[sticker_data_url])
+
+async def handle_animation(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Gestionnaire pour les GIF et animations, transmis via leur miniature."""
+    if not is_authorized(update):
+        return
     
-    # Indiquer que le bot est en train d'écrire
-    await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
+    animation = update.message.animation
+    caption = update.message.caption or "Regarde cette animation !"
     
-    # Envoyer le message et l'image à KinOS
-    response = await send_to_kinos(caption, images=[photo_data_url])
+    if animation.thumbnail is None:
+        await reply_from_kinos(update, context, caption)
+        return
     
-    # Envoyer la réponse
-    await update.message.reply_text(response)
+    animation_data_url = await fetch_media(update, context, animation.thumbnail, "image/jpeg")
+    if animation_data_url is None:
+        return
+    
+    await reply_from_kinos(update, context, caption, images=[animation_data_url])
 
 async def webhook(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Gestionnaire pour les webhooks."""
     # Traiter les mises à jour reçues via webhook
     logger.info(f"Webhook reçu: {update}")
 
+async def record_update(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Enregistre chaque mise à jour reçue quand la capture du trafic est activée."""
+    get_recorder().record_update(update.to_dict())
+
+async def post_init(application: Application) -> None:
+    """Préchauffe les connexions, installe l'arrêt progressif et le rechargement de la configuration, puis reprend les mises à jour de l'instance précédente (mode polling)."""
+    if get_settings().warmup:
+        await warm_up(application.bot)
+        keepalive = KeepAlive(application.bot)
+        keepalive.start()
+        application.bot_data["keepalive"] = keepalive
+    install_signal_handlers(TRACKER, application.updater.stop, application.stop_running)
+    install_reload_handler()
+    await resume_pending(application, TRACKER)
+
+async def post_stop(application: Application) -> None:
+    """Arrête le maintien des connexions et ferme le client de téléchargement des médias."""
+    keepalive = application.bot_data.pop("keepalive", None)
+    if keepalive:
+        keepalive.stop()
+    await close_http_client()
+
+def build_application(token=None, base_url=None, base_file_url=None) -> Application:
+    """
+    Crée l'application du bot et enregistre ses gestionnaires.
+    
+    Args:
+        token (str, optional): Le token du bot. Par défaut TELEGRAM_BOT_TOKEN
+        base_url (str, optional): URL de l'API Bot (pour pointer vers un serveur local de test)
+        base_file_url (str, optional): URL de téléchargement des fichiers
+    
+    Returns:
+        Application: L'application configurée
+    """
+    # Les mises à jour sont traitées en parallèle : un appel lent à KinOS ne bloque pas les autres chats
+    builder = Application.builder().token(token or TELEGRAM_BOT_TOKEN).concurrent_updates(True)
+    if base_url:
+        builder = builder.base_url(base_url)
+    if base_file_url:
+        builder = builder.base_file_url(base_file_url)
+    application = builder.post_init(post_init).post_stop(post_stop).build()
+    
+    # Capture du trafic (SIMBA_CAPTURE_PATH) : avant tous les autres gestionnaires
+    if get_recorder():
+        application.add_handler(TypeHandler(Update, record_update), group=-1)
+    
+    # Ajouter les gestionnaires
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("help", help_command))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, TRACKER.tracked(handle_message)))
+    application.add_handler(MessageHandler(filters.PHOTO, TRACKER.tracked(handle_photo)))
+    application.add_handler(MessageHandler(filters.VOICE | filters.AUDIO, TRACKER.tracked(handle_voice)))
+    # Les animations portent aussi un document : leur gestionnaire doit passer avant
+    application.add_handler(MessageHandler(filters.ANIMATION, TRACKER.tracked(handle_animation)))
+    application.add_handler(MessageHandler(filters.Document.ALL, TRACKER.tracked(handle_document)))
+    application.add_handler(MessageHandler(filters.Sticker.ALL, TRACKER.tracked(handle_sticker)))
+    
+    return application
+
 def main() -> None:
     """Fonction principale pour démarrer le bot."""
-    # Vérifier que les variables d'environnement nécessaires sont définies
+    # Vérifier que les réglages nécessaires sont définis
     if not TELEGRAM_BOT_TOKEN:
         logger.error("La variable d'environnement TELEGRAM_BOT_TOKEN n'est pas définie")
         return
@@ -153,13 +417,7 @@ def main() -> None:
         return
     
     # Créer l'application
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
-    
-    # Ajouter les gestionnaires
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
-    application.add_handler(MessageHandler(filters.PHOTO, handle_photo))
+    application = build_application()
     
     # Déterminer le mode de fonctionnement (polling ou webhook)
     # Sur Render, nous utilisons le webhook
@@ -168,19 +426,31 @@ def main() -> None:
         webhook_url = os.environ.get('RENDER_EXTERNAL_URL')
         if webhook_url:
             logger.info(f"Démarrage en mode webhook sur Render: {webhook_url}")
-            application.run_webhook(
-                listen="0.0.0.0",
-                port=PORT,
+            # Serveur webhook avec les routes /healthz et /readyz pour les vérifications de Render
+            from webhook_server import serve_webhook
+            asyncio.run(serve_webhook(
+                application,
+                TRACKER,
+                webhook_url=f"{webhook_url}/{TELEGRAM_BOT_TOKEN}",
                 url_path=TELEGRAM_BOT_TOKEN,
-                webhook_url=f"{webhook_url}/{TELEGRAM_BOT_TOKEN}"
-            )
+                port=PORT,
+                kinos_probe_url=f"{kinos_client.KINOS_API_BASE}/blueprints/{BLUEPRINT_ID}/kins",
+                kinos_api_key=KINOS_API_KEY,
+                secret_token=TELEGRAM_WEBHOOK_SECRET
+            ))
         else:
             logger.error("Variable RENDER_EXTERNAL_URL non définie")
             sys.exit(1)
     else:
         # En développement local, utiliser le polling
         logger.info("Démarrage en mode polling (développement local)")
-        application.run_polling(allowed_updates=Update.ALL_TYPES)
+        # Les signaux sont gérés par install_signal_handlers (arrêt progressif)
+        application.run_polling(allowed_updates=Update.ALL_TYPES, stop_signals=None)
 
 if __name__ == "__main__":
+    # Configurer les arguments de ligne de commande
+    parser = argparse.ArgumentParser(
+        description="Démarrer le bot Telegram (webhook si RENDER_EXTERNAL_URL est défini, sinon polling)")
+    parser.parse_args()
+    
     main()
@@ -0,0 +1,186 @@
+import os
+import io
+import json
+import gzip
+import time
+import hmac
+import atexit
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Champs d'identité remplacés dans les mises à jour enregistrées
+_IDENTITY_FIELDS = {"first_name", "last_name", "username", "phone_number", "title", "bio", "invite_link"}
+_ID_CONTAINERS = {"from", "chat", "user", "sender_chat", "forward_from", "forward_from_chat", "via_bot"}
+
+def open_capture(path, mode="rt"):
+    """
+    Ouvre un fichier de capture JSONL, compressé selon son extension.
+
+    `.gz` utilise gzip (bibliothèque standard) ; `.zst` nécessite le paquet
+    optionnel `zstandard`. En écriture, le fichier est ouvert en ajout : les
+    redémarrages du bot complètent la même capture.
+
+    Args:
+        path (str): Le chemin du fichier
+        mode (str, optional): "rt" pour lire, "at" pour ajouter
+
+    Returns:
+        file: Un fichier texte
+    """
+    if path.endswith(".zst"):
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError("Le format .zst nécessite le paquet zstandard (pip install zstandard)")
+        if mode.startswith("r"):
+            raw = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), read_across_frames=True)
+        else:
+            raw = zstandard.ZstdCompressor(level=10).stream_writer(open(path, "ab"))
+        return io.TextIOWrapper(raw, encoding="utf-8")
+    if path.endswith(".gz"):
+        return gzip.open(path, mode, encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+def read_capture(path):
+    """
+    Lit les enregistrements d'un fichier de capture.
+
+    Returns:
+        list: Les enregistrements, dans l'ordre chronologique
+    """
+    records = []
+    with open_capture(path, "rt") as capture_file:
+        for line in capture_file:
+            if line.strip():
+                records.append(json.loads(line))
+    records.sort(key=lambda record: record["t"])
+    return records
+
+class TrafficRecorder:
+    """
+    Enregistre le trafic réel du bot pour le rejouer hors ligne.
+
+    Les mises à jour Telegram sont anonymisées (identifiants remplacés par
+    des pseudonymes stables, noms supprimés) et le contenu des médias
+    envoyés à KinOS est remplacé par son empreinte et sa taille ; seul le
+    texte des messages est conservé tel quel.
+
+    Les pseudonymes doivent rester les mêmes d'un redémarrage à l'autre,
+    puisque la capture est complétée en ajout : sans SIMBA_CAPTURE_SALT, le
+    sel est tiré au hasard une fois puis conservé à côté de la capture
+    (`<capture>.salt`). Ce fichier permet de retrouver les identifiants :
+    il ne doit pas être partagé avec la capture.
+    """
+
+    def __init__(self, path, salt=None):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._salt = (salt or os.getenv("SIMBA_CAPTURE_SALT") or self._load_salt(f"{path}.salt")).encode("utf-8")
+        self._lock = threading.Lock()
+        self._file = open_capture(path, "at")
+        atexit.register(self.close)
+
+    @staticmethod
+    def _load_salt(salt_path):
+        """Lit le sel conservé à côté de la capture, ou le crée (lisible par son seul propriétaire)."""
+        try:
+            with open(salt_path, "r", encoding="utf-8") as salt_file:
+                salt = salt_file.read().strip()
+            if salt:
+                return salt
+        except FileNotFoundError:
+            pass
+        salt = os.urandom(16).hex()
+        fd = os.open(salt_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as salt_file:
+            salt_file.write(salt)
+        return salt
+
+    def pseudonym(self, value):
+        """Remplace un identifiant Telegram par un pseudonyme stable (le signe est conservé)."""
+        digest = hmac.new(self._salt, str(value).encode("utf-8"), hashlib.sha256).hexdigest()
+        pseudonym = int(digest[:10], 16)
+        return -pseudonym if isinstance(value, int) and value < 0 else pseudonym
+
+    def sanitize_update(self, data, container=None):
+        if isinstance(data, list):
+            return [self.sanitize_update(item, container) for item in data]
+        if not isinstance(data, dict):
+            return data
+        sanitized = {}
+        for key, value in data.items():
+            if key in _IDENTITY_FIELDS and isinstance(value, str):
+                sanitized[key] = key
+            elif key == "id" and container in _ID_CONTAINERS:
+                sanitized[key] = self.pseudonym(value)
+            else:
+                sanitized[key] = self.sanitize_update(value, key)
+        return sanitized
+
+    @staticmethod
+    def sanitize_payload(payload):
+        sanitized = dict(payload)
+        for key in ("images", "attachments"):
+            if sanitized.get(key):
+                sanitized[key] = [
+                    {"sha256": hashlib.sha256(item.encode("utf-8")).hexdigest(), "length": len(item)}
+                    for item in sanitized[key]
+                ]
+        return sanitized
+
+    def _write(self, record):
+        line = json.dumps(dict(record, t=time.time()), ensure_ascii=False) + "\n"
+        with self._lock:
+            if self._file is not None:
+                self._file.write(line)
+
+    def record_update(self, update_data):
+        """Enregistre une mise à jour Telegram reçue (dictionnaire)."""
+        self._write({"type": "update", "update": self.sanitize_update(update_data)})
+
+    def record_kinos(self, api_url, payload, response, duration):
+        """
+        Enregistre une requête KinOS et sa réponse.
+
+        Args:
+            api_url (str): L'URL appelée
+            payload (dict): Le corps envoyé
+            response (requests.Response): La réponse reçue
+            duration (float): La durée de l'appel, en secondes
+        """
+        try:
+            body = response.json()
+        except ValueError:
+            body = response.text
+        self._write({
+            "type": "kinos",
+            "path": api_url.split("/blueprints/", 1)[-1],
+            "request": self.sanitize_payload(payload),
+            "status": response.status_code,
+            "response": body,
+            "duration": round(duration, 4),
+        })
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+_recorder = None
+
+def get_recorder():
+    """Retourne l'enregistreur partagé, ou None si la capture est désactivée (SIMBA_CAPTURE_PATH)."""
+    global _recorder
+    if _recorder is None:
+        # Lu au premier appel et non à l'import : replay et selftest désactivent la capture avant de lancer le bot
+        capture_path = os.getenv("SIMBA_CAPTURE_PATH")
+        if capture_path:
+            _recorder = TrafficRecorder(capture_path)
+            logger.info(f"Capture du trafic activée: {capture_path}")
+    return _recorder
@@ -0,0 +1,237 @@
+import os
+import time
+import atexit
+import sqlite3
+import logging
+import threading
+from datetime import date
+from settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Emplacement par défaut de la base (modifiable via l'environnement)
+DEFAULT_DB_PATH = os.path.join(os.path.expanduser("~"), ".local", "share", "simba", "usage.db")
+
+METRICS = ("calls", "images", "request_bytes", "response_bytes", "tokens")
+
+# Budgets quotidiens par chat et par kin : réglages budget_<portée>_<métrique> (0 = illimité)
+BUDGET_SCOPES = ("chat", "kin")
+BUDGET_METRICS = ("calls", "images", "tokens")
+
+# Paliers de dégradation avant refus, en fraction du budget consommé
+CHEAP_MODEL_THRESHOLD = 0.7
+SHORT_HISTORY_THRESHOLD = 0.85
+
+# Champs d'usage que KinOS peut renvoyer selon le fournisseur du modèle
+TOKEN_FIELDS = ("input_tokens", "output_tokens", "prompt_tokens", "completion_tokens")
+
+class BudgetExceededError(RuntimeError):
+    """Le budget quotidien d'un chat ou d'un kin est épuisé."""
+
+def count_tokens(result):
+    """
+    Additionne les champs d'usage (tokens) présents dans une réponse KinOS.
+
+    Returns:
+        int: Le nombre de tokens, 0 si la réponse n'en indique pas
+    """
+    if not isinstance(result, dict):
+        return 0
+    usage = result.get("usage")
+    if not isinstance(usage, dict):
+        return 0
+    tokens = sum(usage.get(field) or 0 for field in TOKEN_FIELDS if isinstance(usage.get(field), (int, float)))
+    if not tokens and isinstance(usage.get("total_tokens"), (int, float)):
+        tokens = usage["total_tokens"]
+    return int(tokens)
+
+class UsageAccountant:
+    """
+    Comptabilité de la consommation KinOS par chat, kin et endpoint.
+
+    Les compteurs sont tenus en mémoire et écrits périodiquement dans
+    SQLite (toutes les `flush_interval` secondes, et à la sortie du
+    processus). Les totaux du jour servent au contrôle d'admission : au-delà
+    de certains paliers du budget, les requêtes passent sur un modèle moins
+    cher, puis sur un historique plus court, avant d'être refusées.
+    """
+
+    def __init__(self, db_path=None, flush_interval=None, budgets=None):
+        self.db_path = db_path or os.getenv("SIMBA_USAGE_DB", DEFAULT_DB_PATH)
+        self.flush_interval = flush_interval if flush_interval is not None else get_settings().usage_flush_interval
+        self._budgets = budgets
+        self._lock = threading.Lock()
+        self._pending = {}   # (jour, chat, kin, endpoint) -> compteurs non encore écrits
+        self._totals = {}    # (jour, portée, id) -> compteurs du jour
+        self._last_flush = time.monotonic()
+
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS usage ("
+            "day TEXT NOT NULL, chat_id TEXT NOT NULL, kin_id TEXT NOT NULL, endpoint TEXT NOT NULL, "
+            + ", ".join(f"{metric} INTEGER NOT NULL DEFAULT 0" for metric in METRICS)
+            + ", PRIMARY KEY (day, chat_id, kin_id, endpoint))"
+        )
+        self._db.commit()
+        atexit.register(self.flush)
+
+    def _daily_totals(self, day, scope, scope_id):
+        """Totaux du jour pour un chat ou un kin (base + compteurs en mémoire)."""
+        key = (day, scope, scope_id)
+        if key not in self._totals:
+            column = "chat_id" if scope == "chat" else "kin_id"
+            row = self._db.execute(
+                f"SELECT {', '.join(f'COALESCE(SUM({m}), 0)' for m in METRICS)} "
+                f"FROM usage WHERE day = ? AND {column} = ?",
+                (day, scope_id)
+            ).fetchone()
+            totals = dict(zip(METRICS, row))
+            # Les compteurs pas encore écrits ne sont pas dans la base
+            for (p_day, chat_id, kin_id, _), counters in self._pending.items():
+                if p_day == day and (chat_id if scope == "chat" else kin_id) == scope_id:
+                    for metric in METRICS:
+                        totals[metric] += counters[metric]
+            self._totals[key] = totals
+        return self._totals[key]
+
+    @property
+    def budgets(self):
+        """Budgets en vigueur (relus dans la configuration, qui peut changer à chaud)."""
+        if self._budgets is not None:
+            return self._budgets
+        settings = get_settings()
+        return {
+            scope: {metric: getattr(settings, f"budget_{scope}_{metric}") for metric in BUDGET_METRICS}
+            for scope in BUDGET_SCOPES
+        }
+
+    def budget_ratio(self, chat_id, kin_id):
+        """
+        Fraction du budget quotidien consommée (la plus élevée entre le chat et le kin).
+
+        Returns:
+            float: 0 si aucun budget n'est configuré
+        """
+        day = date.today().isoformat()
+        ratio = 0.0
+        budgets = self.budgets
+        with self._lock:
+            for scope, scope_id in (("chat", chat_id), ("kin", kin_id)):
+                totals = None
+                for metric, budget in budgets.get(scope, {}).items():
+                    if budget > 0:
+                        if totals is None:
+                            totals = self._daily_totals(day, scope, scope_id)
+                        ratio = max(ratio, totals[metric] / budget)
+        return ratio
+
+    def admit(self, chat_id, kin_id, endpoint, payload):
+        """
+        Contrôle d'admission d'une requête selon le budget restant.
+
+        Args:
+            chat_id (str): Le chat à l'origine de la requête
+            kin_id (str): Le kin destinataire
+            endpoint (str): L'endpoint KinOS (messages, analysis, images...)
+            payload (dict): Le corps de la requête
+
+        Returns:
+            dict: Le corps éventuellement dégradé (modèle moins cher, historique plus court)
+
+        Raises:
+            BudgetExceededError: Si le budget quotidien est épuisé
+        """
+        ratio = self.budget_ratio(chat_id, kin_id)
+        if ratio >= 1:
+            raise BudgetExceededError(f"Budget quotidien épuisé pour le chat {chat_id} / kin {kin_id}")
+
+        if ratio >= CHEAP_MODEL_THRESHOLD and "model" in payload and endpoint in ("messages", "analysis"):
+            settings = get_settings()
+            payload = dict(payload, model=settings.cheap_model)
+            if ratio >= SHORT_HISTORY_THRESHOLD and endpoint == "messages":
+                short = settings.short_history_length
+                payload["history_length"] = min(payload.get("history_length", short), short)
+            logger.info(f"Budget consommé à {ratio:.0%} pour le chat {chat_id}: requête dégradée")
+        return payload
+
+    def record(self, chat_id, kin_id, endpoint, images=0, request_bytes=0, response_bytes=0, tokens=0):
+        """Comptabilise un appel à KinOS."""
+        day = date.today().isoformat()
+        delta = {"calls": 1, "images": images, "request_bytes": request_bytes,
+                 "response_bytes": response_bytes, "tokens": tokens}
+        with self._lock:
+            counters = self._pending.setdefault((day, chat_id, kin_id, endpoint), dict.fromkeys(METRICS, 0))
+            for metric, value in delta.items():
+                counters[metric] += value
+            for scope, scope_id in (("chat", chat_id), ("kin", kin_id)):
+                totals = self._totals.get((day, scope, scope_id))
+                if totals is not None:
+                    for metric, value in delta.items():
+                        totals[metric] += value
+            due = time.monotonic() - self._last_flush >= self.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Écrit les compteurs en mémoire dans la base."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+            if not pending:
+                return
+            self._db.executemany(
+                f"INSERT INTO usage (day, chat_id, kin_id, endpoint, {', '.join(METRICS)}) "
+                f"VALUES (?, ?, ?, ?, {', '.join('?' for _ in METRICS)}) "
+                f"ON CONFLICT (day, chat_id, kin_id, endpoint) DO UPDATE SET "
+                + ", ".join(f"{m} = {m} + excluded.{m}" for m in METRICS),
+                [key + tuple(counters[m] for m in METRICS) for key, counters in pending.items()]
+            )
+            self._db.commit()
+
+    def report(self, day=None):
+        """
+        Retourne la consommation d'une journée, par chat, kin et endpoint.
+
+        Returns:
+            list: Une entrée par (chat, kin, endpoint)
+        """
+        self.flush()
+        day = day or date.today().isoformat()
+        with self._lock:
+            cursor = self._db.cursor()
+            cursor.row_factory = sqlite3.Row
+            rows = cursor.execute(
+                "SELECT * FROM usage WHERE day = ? ORDER BY chat_id, kin_id, endpoint", (day,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+_default_accountant = None
+_default_lock = threading.Lock()
+
+def get_accountant():
+    """Retourne l'instance partagée de la comptabilité (une seule, même appelée depuis plusieurs threads)."""
+    global _default_accountant
+    if _default_accountant is None:
+        with _default_lock:
+            if _default_accountant is None:
+                _default_accountant = UsageAccountant()
+    return _default_accountant
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Afficher la consommation KinOS d'une journée")
+    parser.add_argument("--day", help="Jour au format AAAA-MM-JJ (par défaut aujourd'hui)")
+    args = parser.parse_args()
+
+    rows = get_accountant().report(args.day)
+    if not rows:
+        print("Aucune consommation enregistrée")
+    else:
+        print(f"{'Chat':<16}{'Kin':<12}{'Endpoint':<22}{'Appels':>8}{'Images':>8}{'Tokens':>10}{'Octets envoyés':>16}")
+        for row in rows:
+            print(f"{row['chat_id']:<16}{row['kin_id']:<12}{row['endpoint']:<22}"
+                  f"{row['calls']:>8}{row['images']:>8}{row['tokens']:>10}{row['request_bytes']:>16}")
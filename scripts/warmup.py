@@ -0,0 +1,113 @@
+import time
+import socket
+import asyncio
+import logging
+from urllib.parse import urlparse
+import kinos_client
+from settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+def resolve_hosts(urls):
+    """
+    Résout à l'avance les noms d'hôte des API.
+
+    Returns:
+        dict: Hôte -> durée de résolution en secondes (None en cas d'échec)
+    """
+    timings = {}
+    for url in urls:
+        parsed = urlparse(url)
+        start = time.monotonic()
+        try:
+            socket.getaddrinfo(parsed.hostname, parsed.port or (443 if parsed.scheme == "https" else 80),
+                               type=socket.SOCK_STREAM)
+            timings[parsed.hostname] = time.monotonic() - start
+        except OSError as e:
+            logger.warning(f"Résolution DNS impossible pour {parsed.hostname}: {e}")
+            timings[parsed.hostname] = None
+    return timings
+
+async def warm_up(bot, timeout=None):
+    """
+    Prépare le processus avant de recevoir la première mise à jour.
+
+    Les noms d'hôte de Telegram et de KinOS sont résolus, puis une connexion
+    est ouverte vers chaque API et conservée dans son pool, pour que la
+    première réponse ne paie ni DNS, ni TCP, ni TLS.
+
+    Args:
+        bot (telegram.Bot): Le bot Telegram (déjà initialisé)
+        timeout (float, optional): Durée maximale du préchauffage, en secondes. Par défaut le réglage warmup_timeout
+
+    Returns:
+        dict: Les durées de chaque étape, en secondes
+    """
+    timeout = timeout if timeout is not None else get_settings().warmup_timeout
+    timings = {}
+    start = time.monotonic()
+
+    async def run():
+        dns = await asyncio.to_thread(resolve_hosts, [bot.base_url, kinos_client.KINOS_API_BASE])
+        timings.update({f"dns {host}": elapsed for host, elapsed in dns.items()})
+
+        async def telegram():
+            step = time.monotonic()
+            await bot.get_me()
+            timings["telegram"] = time.monotonic() - step
+
+        async def kinos():
+            timings["kinos"] = await asyncio.to_thread(kinos_client.ping)
+
+        await asyncio.gather(telegram(), kinos(), return_exceptions=True)
+
+    try:
+        await asyncio.wait_for(run(), timeout)
+    except asyncio.TimeoutError:
+        logger.warning(f"Préchauffage interrompu après {timeout} s")
+    timings["total"] = time.monotonic() - start
+
+    logger.info("Préchauffage terminé: " + ", ".join(
+        f"{name} {elapsed * 1000:.0f} ms" for name, elapsed in timings.items() if elapsed is not None
+    ))
+    return timings
+
+class KeepAlive:
+    """
+    Maintient les connexions ouvertes pendant les périodes d'inactivité.
+
+    Sans trafic, les serveurs et équipements réseau ferment les connexions
+    inactives au bout de quelques minutes ; un appel léger à intervalle
+    régulier (`getMe` et une requête HEAD vers KinOS) évite de repayer
+    l'ouverture de connexion au message suivant.
+    """
+
+    def __init__(self, bot, interval=None):
+        self.bot = bot
+        self._interval = interval
+        self._task = None
+
+    @property
+    def interval(self):
+        """Intervalle en secondes (réglage keepalive_interval, modifiable à chaud ; 0 = en pause)."""
+        return self._interval if self._interval is not None else get_settings().keepalive_interval
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+
+    async def _run(self):
+        while True:
+            interval = self.interval
+            await asyncio.sleep(interval or 60)
+            if not interval:
+                continue
+            results = await asyncio.gather(
+                self.bot.get_me(), asyncio.to_thread(kinos_client.ping), return_exceptions=True
+            )
+            for result in results:
+                if isinstance(result, Exception):
+                    logger.warning(f"Échec du maintien de connexion: {result}")
@@ -0,0 +1,230 @@
+import json
+import time
+import asyncio
+import logging
+import tornado.web
+import tornado.httpserver
+from telegram import Update
+import kinos_client
+from shutdown import install_signal_handlers, resume_pending
+from warmup import KeepAlive, warm_up
+from settings import get_settings, install_reload_handler
+
+logger = logging.getLogger(__name__)
+
+# Les seuils de santé et la durée de cache des sondes sont des réglages modifiables à chaud
+PROBE_TIMEOUT = 5
+
+class Heartbeat:
+    """Mesure la réactivité de la boucle d'événements."""
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.last_beat = time.monotonic()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+
+    async def _run(self):
+        while True:
+            self.last_beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+
+    @property
+    def lag(self):
+        """Retard de la boucle en secondes (0 si elle tourne normalement)."""
+        return max(0.0, time.monotonic() - self.last_beat - self.interval)
+
+class UpstreamProbe:
+    """
+    Sonde de disponibilité de KinOS et de Telegram (`getMe`).
+
+    Le résultat est mis en cache pendant `ttl` secondes et une seule sonde
+    est en cours à la fois : les vérifications de santé de Render
+    n'ajoutent aucune charge sur les API en amont.
+    """
+
+    def __init__(self, bot, kinos_url, api_key, ttl=None):
+        self.bot = bot
+        self.kinos_url = kinos_url
+        self.api_key = api_key
+        self._ttl = ttl
+        self._result = None
+        self._checked_at = 0.0
+        self._inflight = None
+
+    @property
+    def ttl(self):
+        return self._ttl if self._ttl is not None else get_settings().ready_probe_ttl
+
+    async def status(self):
+        """
+        Retourne le dernier état connu des API en amont, en le rafraîchissant si besoin.
+
+        Returns:
+            dict: {"telegram": {...}, "kinos": {...}, "checked_at": ...}
+        """
+        if self._result is not None and time.monotonic() - self._checked_at < self.ttl:
+            return self._result
+        if self._inflight is None:
+            self._inflight = asyncio.get_running_loop().create_task(self._probe())
+        try:
+            return await asyncio.shield(self._inflight)
+        finally:
+            if self._inflight is not None and self._inflight.done():
+                self._inflight = None
+
+    async def _probe(self):
+        telegram_status, kinos_status = await asyncio.gather(self._probe_telegram(), self._probe_kinos())
+        self._result = {"telegram": telegram_status, "kinos": kinos_status, "checked_at": time.time()}
+        self._checked_at = time.monotonic()
+        return self._result
+
+    async def _probe_telegram(self):
+        start = time.monotonic()
+        try:
+            await self.bot.get_me()
+            return {"ok": True, "latency_ms": round((time.monotonic() - start) * 1000)}
+        except Exception as e:
+            return {"ok": False, "error": str(e)}
+
+    async def _probe_kinos(self):
+        start = time.monotonic()
+        try:
+            response = await asyncio.to_thread(
+                kinos_client.get_session().get, self.kinos_url,
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                timeout=PROBE_TIMEOUT
+            )
+            # Une erreur serveur ou d'authentification rend le service inutilisable
+            ok = response.status_code < 500 and response.status_code not in (401, 403)
+            result = {"ok": ok, "status": response.status_code,
+                      "latency_ms": round((time.monotonic() - start) * 1000)}
+            return result
+        except Exception as e:
+            return {"ok": False, "error": str(e)}
+
+class TelegramWebhookHandler(tornado.web.RequestHandler):
+    """Reçoit les mises à jour de Telegram et les place dans la file du bot."""
+
+    def initialize(self, bot_application, secret_token):
+        self.bot_application = bot_application
+        self.secret_token = secret_token
+
+    async def post(self):
+        if self.secret_token and self.request.headers.get("X-Telegram-Bot-Api-Secret-Token") != self.secret_token:
+            raise tornado.web.HTTPError(403)
+        try:
+            update = Update.de_json(json.loads(self.request.body), self.bot_application.bot)
+        except Exception as e:
+            logger.error(f"Mise à jour illisible reçue sur le webhook: {e}")
+            raise tornado.web.HTTPError(400)
+        if update:
+            await self.bot_application.update_queue.put(update)
+
+class HealthHandler(tornado.web.RequestHandler):
+    """`/healthz` : boucle d'événements réactive et file d'attente sous le seuil."""
+
+    def initialize(self, bot_application, tracker, heartbeat):
+        self.bot_application = bot_application
+        self.tracker = tracker
+        self.heartbeat = heartbeat
+
+    def get(self):
+        queue_depth = self.bot_application.update_queue.qsize() + len(self.tracker)
+        lag = self.heartbeat.lag
+        settings = get_settings()
+        healthy = queue_depth < settings.health_max_queue and lag < settings.health_max_loop_lag
+        self.set_status(200 if healthy else 503)
+        self.write({"ok": healthy, "queue_depth": queue_depth, "loop_lag_s": round(lag, 3)})
+
+class ReadyHandler(tornado.web.RequestHandler):
+    """`/readyz` : état des API en amont, via la sonde mise en cache."""
+
+    def initialize(self, tracker, probe):
+        self.tracker = tracker
+        self.probe = probe
+
+    async def get(self):
+        if not self.tracker.accepting:
+            self.set_status(503)
+            self.write({"ok": False, "reason": "arrêt en cours"})
+            return
+        status = await self.probe.status()
+        ready = status["telegram"]["ok"] and status["kinos"]["ok"]
+        self.set_status(200 if ready else 503)
+        self.write(dict(status, ok=ready))
+
+def make_app(application, tracker, heartbeat, probe, url_path, secret_token=None):
+    """Construit l'application tornado (webhook, santé et disponibilité)."""
+    return tornado.web.Application([
+        (f"/{url_path}", TelegramWebhookHandler, {"bot_application": application, "secret_token": secret_token}),
+        (r"/healthz", HealthHandler, {"bot_application": application, "tracker": tracker, "heartbeat": heartbeat}),
+        (r"/readyz", ReadyHandler, {"tracker": tracker, "probe": probe}),
+    ])
+
+async def serve_webhook(application, tracker, webhook_url, url_path, port, kinos_probe_url, kinos_api_key,
+                        listen="0.0.0.0", secret_token=None, install_signals=True, started=None, stopped=None,
+                        warm=None):
+    """
+    Sert le webhook Telegram avec les routes `/healthz` et `/readyz`.
+
+    Args:
+        application (Application): L'application du bot
+        tracker (InflightTracker): Le suivi des mises à jour en cours
+        webhook_url (str): L'URL publique du webhook (None pour ne pas l'enregistrer auprès de Telegram)
+        url_path (str): Le chemin du webhook
+        port (int): Le port d'écoute
+        kinos_probe_url (str): L'URL sondée pour la disponibilité de KinOS
+        kinos_api_key (str): La clé API KinOS
+        listen (str, optional): L'adresse d'écoute
+        secret_token (str, optional): Le secret attendu dans l'en-tête des requêtes de Telegram
+        install_signals (bool, optional): Installer l'arrêt progressif sur SIGTERM/SIGINT et le rechargement sur SIGHUP
+        started (asyncio.Event, optional): Signalé une fois le serveur prêt
+        stopped (asyncio.Event, optional): Arrête le serveur quand il est signalé
+        warm (bool, optional): Préchauffer les connexions avant d'écouter, puis les maintenir ouvertes.
+            Par défaut le réglage warmup
+    """
+    warm = get_settings().warmup if warm is None else warm
+    stopped = stopped or asyncio.Event()
+    heartbeat = Heartbeat()
+    keepalive = KeepAlive(application.bot)
+    probe = UpstreamProbe(application.bot, kinos_probe_url, kinos_api_key)
+    server = tornado.httpserver.HTTPServer(
+        make_app(application, tracker, heartbeat, probe, url_path, secret_token)
+    )
+
+    async def stop_accepting():
+        server.stop()
+
+    async with application:
+        heartbeat.start()
+        if warm:
+            # Connexions ouvertes avant d'annoncer le service prêt : le premier message ne les paie pas
+            await warm_up(application.bot)
+            keepalive.start()
+        server.listen(port, listen)
+        if webhook_url:
+            await application.bot.set_webhook(
+                url=webhook_url, allowed_updates=Update.ALL_TYPES, secret_token=secret_token
+            )
+        await application.start()
+        await resume_pending(application, tracker)
+        if install_signals:
+            install_signal_handlers(tracker, stop_accepting, stopped.set)
+            install_reload_handler()
+        logger.info(f"Serveur webhook démarré sur le port {port}")
+        if started:
+            started.set()
+
+        await stopped.wait()
+
+        server.stop()
+        heartbeat.stop()
+        keepalive.stop()
+        await application.stop()